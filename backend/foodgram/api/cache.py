@@ -0,0 +1,187 @@
+from functools import wraps
+from hashlib import sha1
+from typing import List, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from recipes.models import ShoppingCart
+from recipes.versions import (
+    get_catalog_version,
+    get_counter_versions,
+    get_last_modified,
+    get_recipe_versions,
+    get_user_version,
+)
+
+
+def get_normalized_params(request, ignored=()):
+    return sorted(
+        (key, sorted(request.query_params.getlist(key)))
+        for key in request.query_params
+        if key not in ignored
+    )
+
+
+def get_response_cache_key(request) -> str:
+    digest = sha1(
+        repr(
+            (request.get_host(), request.path, get_normalized_params(request))
+        ).encode()
+    ).hexdigest()
+    return f"recipes-response:{get_catalog_version()}:{digest}"
+
+
+def get_counter_ids(data) -> Tuple[List[int], List[int]]:
+    """Return ids of the recipes and authors whose counters are shown in a
+    recipe list, page or detail body."""
+    if isinstance(data, dict):
+        items = data.get("results", [data])
+    else:
+        items = data
+    recipe_ids = sorted({item["id"] for item in items})
+    author_ids = sorted({item["author"]["id"] for item in items})
+    return recipe_ids, author_ids
+
+
+def cache_anonymous_response(view_method):
+    """Cache successful responses of anonymous GET requests of recipes
+    under the normalized query and the current recipe catalog version.
+
+    The counter versions of the shown recipes and authors are stored with
+    the body, a cached body whose counters changed since is built again.
+    """
+
+    @wraps(view_method)
+    def wrapper(view, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return view_method(view, request, *args, **kwargs)
+
+        key = get_response_cache_key(request)
+        cached = cache.get(key)
+        if cached is not None:
+            data, counter_ids, counter_versions = cached
+            if get_counter_versions(*counter_ids) == counter_versions:
+                return Response(data)
+
+        response = view_method(view, request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            counter_ids = get_counter_ids(response.data)
+            cache.set(
+                key,
+                (
+                    response.data,
+                    counter_ids,
+                    get_counter_versions(*counter_ids),
+                ),
+                settings.RECIPES_RESPONSE_CACHE_TIMEOUT,
+            )
+        return response
+
+    return wrapper
+
+
+def get_shopping_cart_hash(user) -> str:
+    """Return a hash of the user's shopping cart contents: the carted
+    recipes and the versions of their ingredients."""
+    recipe_ids = sorted(
+        ShoppingCart.objects.filter(user=user).values_list(
+            "recipe_id", flat=True
+        )
+    )
+    versions = get_recipe_versions(recipe_ids)
+    return sha1(
+        repr([(pk, versions[pk]) for pk in recipe_ids]).encode()
+    ).hexdigest()
+
+
+def get_validators_digest(request, versions, per_user=False) -> str:
+    user_id = None
+    if per_user and request.user.is_authenticated:
+        user_id = request.user.pk
+    return sha1(
+        repr(
+            (
+                versions,
+                user_id,
+                request.get_host(),
+                request.path,
+                get_normalized_params(request),
+            )
+        ).encode()
+    ).hexdigest()
+
+
+def get_validators(digest, versions, counter_versions=None):
+    """Return the strong ETag and the Last-Modified timestamp of a response
+    from its digest, its versions and the versions of the shown
+    counters."""
+    versions = list(versions)
+    if counter_versions is not None:
+        digest = sha1(
+            repr((digest, sorted(counter_versions.items()))).encode()
+        ).hexdigest()
+        versions.extend(counter_versions.values())
+    return quote_etag(digest), max(map(get_last_modified, versions))
+
+
+def conditional_response(
+    per_user=False, counters=False, get_version=get_catalog_version
+):
+    """Answer GET requests with matching If-None-Match or If-Modified-Since
+    headers with 304 before the view method runs.
+
+    Validators come from ``get_version()`` and, for per-user responses of
+    authenticated users, from the version of the user's flags. Responses
+    with ``counters`` also depend on the counter versions of the shown
+    recipes and authors: their ids are remembered by the response digest,
+    so the next request is validated without running the view.
+    """
+
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(view, request, *args, **kwargs):
+            versions = [get_version()]
+            if per_user and request.user.is_authenticated:
+                versions.append(get_user_version(request.user.pk))
+            digest = get_validators_digest(request, versions, per_user)
+
+            response = None
+            counter_ids_key = f"counter-ids:{digest}"
+            counter_ids = cache.get(counter_ids_key) if counters else None
+            if not counters or counter_ids is not None:
+                counter_versions = None
+                if counters:
+                    counter_versions = get_counter_versions(*counter_ids)
+                etag, last_modified = get_validators(
+                    digest, versions, counter_versions
+                )
+                response = get_conditional_response(
+                    request, etag=etag, last_modified=last_modified
+                )
+            if response is None:
+                response = view_method(view, request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                if counters:
+                    counter_ids = get_counter_ids(response.data)
+                    cache.set(
+                        counter_ids_key,
+                        counter_ids,
+                        settings.RECIPES_RESPONSE_CACHE_TIMEOUT,
+                    )
+                    etag, last_modified = get_validators(
+                        digest, versions, get_counter_versions(*counter_ids)
+                    )
+
+            response["ETag"] = etag
+            response["Last-Modified"] = http_date(last_modified)
+            return response
+
+        return wrapper
+
+    return decorator
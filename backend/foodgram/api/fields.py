@@ -0,0 +1,133 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.files import File
+from drf_extra_fields.fields import Base64ImageField
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import ImageField
+from rest_framework.relations import (MANY_RELATION_KWARGS, ManyRelatedField,
+                                      PrimaryKeyRelatedField)
+from rest_framework.serializers import ListSerializer
+
+
+class BulkPrimaryKeyRelatedField(PrimaryKeyRelatedField):
+    """Primary key related field resolving the ids of a whole list with
+    one in_bulk() query.
+
+    The list is preloaded by the many=True field or by a list serializer
+    of the serializer declaring the field, items are then looked up in
+    memory and unknown ids fail with the usual ``does_not_exist`` error.
+    """
+
+    _preloaded = None
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+    def to_python_pk(self, data):
+        if self.pk_field is not None:
+            return self.pk_field.to_internal_value(data)
+        return self.get_queryset().model._meta.pk.to_python(data)
+
+    def preload(self, values):
+        pks = set()
+        for value in values:
+            try:
+                pks.add(self.to_python_pk(value))
+            except (TypeError, ValueError, DjangoValidationError):
+                # reported for the item by to_internal_value()
+                continue
+        self._preloaded = self.get_queryset().in_bulk(pks)
+
+    def clear_preloaded(self):
+        self._preloaded = None
+
+    def to_internal_value(self, data):
+        if self._preloaded is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = self.to_python_pk(data)
+        except (TypeError, ValueError, DjangoValidationError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return self._preloaded[pk]
+        except (KeyError, TypeError):
+            self.fail('does_not_exist', pk_value=data)
+
+
+class BulkManyRelatedField(ManyRelatedField):
+    def to_internal_value(self, data):
+        if isinstance(data, (list, tuple)):
+            self.child_relation.preload(data)
+        try:
+            return super().to_internal_value(data)
+        finally:
+            self.child_relation.clear_preloaded()
+
+
+class BulkRelatedListSerializer(ListSerializer):
+    """List serializer preloading the ``BulkPrimaryKeyRelatedField``
+    fields of its child for all items."""
+
+    def to_internal_value(self, data):
+        fields = [
+            (name, field) for name, field in self.child.fields.items()
+            if isinstance(field, BulkPrimaryKeyRelatedField)
+        ]
+        if isinstance(data, (list, tuple)):
+            for name, field in fields:
+                field.preload(
+                    item[name] for item in data
+                    if isinstance(item, dict) and name in item
+                )
+        try:
+            return super().to_internal_value(data)
+        finally:
+            for _, field in fields:
+                field.clear_preloaded()
+
+
+class RecipeImageField(Base64ImageField):
+    """Image field taking a base64 string or an uploaded file.
+
+    Base64 strings are checked against settings.RECIPE_IMAGE_MAX_UPLOAD_SIZE
+    before they are decoded, uploaded files were streamed to temporary
+    files by LimitedTemporaryFileUploadHandler and are only opened to read
+    the image header. Images with a side longer than
+    settings.RECIPE_IMAGE_MAX_UPLOAD_SIDE are rejected.
+    """
+
+    default_error_messages = {
+        'max_upload_size': 'Ensure the image has at most {max_size} bytes.',
+        'max_upload_side': (
+            'Ensure the image sides are at most {max_side} pixels.'),
+    }
+
+    def to_internal_value(self, data):
+        max_size = settings.RECIPE_IMAGE_MAX_UPLOAD_SIZE
+        if isinstance(data, File):
+            if data.size > max_size:
+                self.fail('max_upload_size', max_size=max_size)
+            file = ImageField.to_internal_value(self, data)
+            extension = file.image.format.lower()
+            extension = 'jpg' if extension == 'jpeg' else extension
+            if extension not in self.ALLOWED_TYPES:
+                raise ValidationError(self.INVALID_TYPE_MESSAGE)
+            file.name = f'{self.get_file_name(file)}.{extension}'
+        else:
+            if isinstance(data, str):
+                encoded = data.rpartition(';base64,')[2]
+                if len(encoded) // 4 * 3 > max_size:
+                    self.fail('max_upload_size', max_size=max_size)
+            file = super().to_internal_value(data)
+
+        max_side = settings.RECIPE_IMAGE_MAX_UPLOAD_SIDE
+        if file is not None and max(file.image.size) > max_side:
+            self.fail('max_upload_side', max_side=max_side)
+        return file
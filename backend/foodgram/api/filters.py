@@ -1,19 +1,54 @@
 
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connections
+from django.db.models import Case, IntegerField, Q, Value, When
 from django_filters.rest_framework import FilterSet, filters
 
-from recipes.models import Ingredient, Recipe, Tag
+from recipes.models import Ingredient, Recipe
+from recipes.registry import tag_registry
 
 User = get_user_model()
 
 
+def get_tag_slug_choices():
+    return tag_registry.slug_choices()
+
+
 class IngredientFilter(FilterSet):
-    name = filters.CharFilter(
-        field_name='name', lookup_expr='istartswith')
+    """Ingredient search by name prefix.
+
+    With ``fuzzy`` set, names containing the query follow the prefix
+    matches. On PostgreSQL fuzzy search is typo tolerant and uses the
+    trigram index, results are ranked by similarity.
+    """
+    name = filters.CharFilter(method='filter_name')
+    fuzzy = filters.BooleanFilter(method='filter_fuzzy')
+
+    def filter_name(self, queryset, name, value):
+        if not self.form.cleaned_data.get('fuzzy'):
+            return queryset.filter(name__istartswith=value)
+
+        queryset = queryset.annotate(is_prefix=Case(
+            When(name__istartswith=value, then=Value(0)),
+            default=Value(1),
+            output_field=IntegerField()))
+        if connections[queryset.db].vendor != 'postgresql':
+            return queryset.filter(
+                name__icontains=value).order_by('is_prefix', 'pk')
+
+        return queryset.filter(
+            Q(name__istartswith=value) | Q(name__trigram_similar=value)
+        ).annotate(
+            similarity=TrigramSimilarity('name', value)
+        ).order_by('is_prefix', '-similarity', 'pk')
+
+    def filter_fuzzy(self, queryset, name, value):
+        return queryset
 
     class Meta():
         model = Ingredient
-        fields = ['name', ]
+        fields = ['name', 'fuzzy']
 
 
 class RecipeFilter(FilterSet):
@@ -21,9 +56,8 @@ class RecipeFilter(FilterSet):
     is_favorited = filters.NumberFilter(method='filter_is_favorited')
     is_in_shopping_cart = filters.NumberFilter(
         method='filter_is_in_shopping_cart')
-    tags = filters.ModelMultipleChoiceFilter(field_name='tag__slug',
-                                             to_field_name='slug',
-                                             queryset=Tag.objects.all())
+    tags = filters.MultipleChoiceFilter(field_name='tag__slug',
+                                        choices=get_tag_slug_choices)
 
     def filter_is_favorited(self, queryset, name, value):
         if self.request.user.is_authenticated and value:
@@ -0,0 +1,98 @@
+import traceback
+from datetime import timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from recipes.models import ShoppingListJob
+
+from .renders import render_shopping_list
+
+Status = ShoppingListJob.Status
+
+
+def enqueue_shopping_list(user, content_hash: str) -> ShoppingListJob:
+    """Return a job rendering the shopping list of a user.
+
+    A job of the same cart contents which is not failed is reused, so
+    repeated clicks on the download button render the document once.
+    """
+    job = (
+        ShoppingListJob.objects.filter(user=user, content_hash=content_hash)
+        .exclude(status=Status.FAILED)
+        .defer("document")
+        .last()
+    )
+    if job is None:
+        job = ShoppingListJob.objects.create(
+            user=user, content_hash=content_hash
+        )
+    return job
+
+
+def claim_shopping_list_job() -> Optional[ShoppingListJob]:
+    with transaction.atomic():
+        job = (
+            ShoppingListJob.objects.select_for_update(skip_locked=True)
+            .filter(status=Status.PENDING)
+            .select_related("user")
+            .order_by("created")
+            .first()
+        )
+        if job is not None:
+            job.status = Status.RUNNING
+            job.attempts += 1
+            job.started = timezone.now()
+            job.save(update_fields=("status", "attempts", "started"))
+    return job
+
+
+def run_shopping_list_job() -> Optional[ShoppingListJob]:
+    """Render the oldest pending shopping list.
+
+    Returns the processed job or None if there are no pending jobs.
+    """
+    job = claim_shopping_list_job()
+    if job is None:
+        return None
+
+    try:
+        job.document = render_shopping_list(job.user)
+        job.status = Status.DONE
+    except Exception:
+        job.error = traceback.format_exc()
+        job.status = Status.FAILED
+    job.finished = timezone.now()
+    job.save(update_fields=("document", "status", "error", "finished"))
+    return job
+
+
+def requeue_stale_shopping_list_jobs() -> int:
+    """Return jobs running longer than settings.SHOPPING_LIST_JOB_TIMEOUT,
+    whose worker was stopped, to the queue or fail them after
+    settings.SHOPPING_LIST_JOB_MAX_ATTEMPTS attempts, so they are not
+    reused by enqueue_shopping_list() forever.
+    """
+    now = timezone.now()
+    stale = ShoppingListJob.objects.filter(
+        status=Status.RUNNING,
+        started__lt=now
+        - timedelta(seconds=settings.SHOPPING_LIST_JOB_TIMEOUT),
+    )
+    failed = stale.filter(
+        attempts__gte=settings.SHOPPING_LIST_JOB_MAX_ATTEMPTS
+    ).update(
+        status=Status.FAILED, finished=now, error="The worker was stopped"
+    )
+    requeued = stale.update(status=Status.PENDING)
+    return failed + requeued
+
+
+def delete_expired_shopping_list_jobs() -> int:
+    expired = timezone.now() - timedelta(
+        seconds=settings.SHOPPING_LIST_JOB_TTL
+    )
+    deleted, _ = ShoppingListJob.objects.filter(created__lt=expired).delete()
+    return deleted
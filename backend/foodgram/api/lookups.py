@@ -0,0 +1,61 @@
+from collections import OrderedDict
+
+from users.models import Subscribe
+
+SUBSCRIPTIONS_CACHE_SIZE = 1000
+
+
+class SubscriptionLookup:
+    """Authors followed by a user, loaded with a single query.
+
+    Up to ``max_size`` followed author ids are kept in memory. For users
+    following more authors than that the remaining ids are checked one by
+    one and memoized in an LRU cache bounded by the same size.
+    """
+
+    def __init__(self, user, max_size: int = SUBSCRIPTIONS_CACHE_SIZE):
+        self.user = user
+        self.max_size = max_size
+        self._author_ids = None
+        self._is_complete = False
+        self._memo = OrderedDict()
+
+    def _load(self):
+        author_ids = list(
+            Subscribe.objects.filter(user=self.user).values_list(
+                "subscribe_id", flat=True
+            )[: self.max_size + 1]
+        )
+        self._is_complete = len(author_ids) <= self.max_size
+        self._author_ids = frozenset(author_ids[: self.max_size])
+
+    def is_subscribed(self, author_id: int) -> bool:
+        if self._author_ids is None:
+            self._load()
+
+        if author_id in self._author_ids:
+            return True
+        if self._is_complete:
+            return False
+
+        if author_id in self._memo:
+            self._memo.move_to_end(author_id)
+            return self._memo[author_id]
+
+        is_subscribed = Subscribe.objects.filter(
+            user=self.user, subscribe_id=author_id
+        ).exists()
+        self._memo[author_id] = is_subscribed
+        if len(self._memo) > self.max_size:
+            self._memo.popitem(last=False)
+        return is_subscribed
+
+
+def get_subscription_lookup(request) -> SubscriptionLookup:
+    """Return the SubscriptionLookup shared by everything serialized
+    during the given request."""
+    lookup = getattr(request, "_subscription_lookup", None)
+    if lookup is None or lookup.user != request.user:
+        lookup = SubscriptionLookup(request.user)
+        request._subscription_lookup = lookup
+    return lookup
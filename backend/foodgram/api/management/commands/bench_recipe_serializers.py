@@ -0,0 +1,50 @@
+import timeit
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIRequestFactory
+
+from api.readers import RecipeReader
+from api.serializers import GetRecipeSerializer
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Compare GetRecipeSerializer with the RecipeReader fast path '
+            'on the latest recipes of the current database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        count = options['count']
+        repeat = options['repeat']
+        request = APIRequestFactory().get('/api/recipes/')
+        request.user = AnonymousUser()
+        recipe_ids = list(
+            Recipe.objects.values_list('pk', flat=True)[:count])
+        if not recipe_ids:
+            self.stderr.write('There are no recipes to serialize')
+            return
+        queryset = Recipe.objects.filter(pk__in=recipe_ids).prefetch_related(
+            'author', 'ingredients__ingredient')
+
+        def serialize():
+            GetRecipeSerializer(
+                queryset.all(), many=True, context={'request': request}
+            ).data
+
+        def read():
+            reader = RecipeReader(request)
+            reader.represent(reader.get_values(queryset.all()))
+
+        results = {}
+        for name, function in (('serializer', serialize),
+                               ('reader', read)):
+            seconds = min(timeit.repeat(function, number=1, repeat=repeat))
+            results[name] = seconds * 1000 * 100 / len(recipe_ids)
+            self.stdout.write(
+                f'{name}: {results[name]:.2f} ms per 100 recipes')
+        self.stdout.write(
+            f'speedup: {results["serializer"] / results["reader"]:.1f}x')
@@ -0,0 +1,56 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from rest_framework.response import Response
+
+from api import renders
+from api.renders import ShoppingListToPDFRenderer, load_pdf_resources
+
+
+class Command(BaseCommand):
+    help = ('Measure shopping list PDF render latency and memory with the '
+            'font and layout loaded per render and once per process')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=30)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def render(self, data, cold):
+        if cold:
+            load_pdf_resources.cache_clear()
+            renders._page_templates.templates = None
+        renderer_context = {'response': Response(data)}
+        ShoppingListToPDFRenderer().render(
+            data, renderer_context=renderer_context)
+
+    def measure(self, data, repeat, cold):
+        durations = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            self.render(data, cold)
+            durations.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        self.render(data, cold)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return min(durations) * 1000, peak / 2 ** 20
+
+    def handle(self, *args, **options):
+        data = [
+            {
+                'ingredient__name': f'ingredient {number}',
+                'ingredient__measurement_unit': 'g',
+                'total': number,
+            }
+            for number in range(options['lines'])
+        ]
+        # the first render of the process always loads the resources
+        self.render(data, cold=False)
+
+        for name, cold in (('per render', True), ('per process', False)):
+            latency, peak = self.measure(data, options['repeat'], cold)
+            self.stdout.write(
+                f'font loaded {name}: {latency:.1f} ms, '
+                f'peak {peak:.1f} MiB per render')
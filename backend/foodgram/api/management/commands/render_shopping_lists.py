@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.jobs import (delete_expired_shopping_list_jobs,
+                      requeue_stale_shopping_list_jobs, run_shopping_list_job)
+
+
+class Command(BaseCommand):
+    help = ('Render shopping list PDFs requested with async downloads. '
+            'Several workers may run at once')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='seconds to wait when there are no jobs')
+        parser.add_argument('--once', action='store_true',
+                            help='exit when there are no pending jobs')
+
+    def handle(self, *args, **options):
+        while True:
+            requeue_stale_shopping_list_jobs()
+            delete_expired_shopping_list_jobs()
+            while True:
+                job = run_shopping_list_job()
+                if job is None:
+                    break
+                self.stdout.write(f'{job.pk}: {job.status}')
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -1,5 +1,216 @@
-from rest_framework.pagination import PageNumberPagination
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import datetime
+from functools import partial
+from hashlib import sha1
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from recipes.versions import get_catalog_version, get_user_version
+
+from .cache import get_normalized_params
+
+
+class CachedCountPaginator(Paginator):
+    """Django paginator which caches the total count under the given key
+    and may take it from the PostgreSQL planner statistics.
+
+    The estimate is used only for querysets without WHERE conditions on
+    tables with at least ``estimate_threshold`` rows, smaller tables are
+    counted exactly.
+    """
+
+    def __init__(self, object_list, per_page, cache_key=None,
+                 cache_timeout=None, estimate_threshold=None, **kwargs):
+        self.cache_key = cache_key
+        self.cache_timeout = cache_timeout
+        self.estimate_threshold = estimate_threshold
+        super().__init__(object_list, per_page, **kwargs)
+
+    def get_estimated_count(self):
+        queryset = self.object_list
+        if (self.estimate_threshold is None
+                or not isinstance(queryset, QuerySet)
+                or queryset.query.where):
+            return None
+
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+                [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        if row is None or row[0] < self.estimate_threshold:
+            return None
+        return row[0]
+
+    @cached_property
+    def count(self):
+        if self.cache_key is not None:
+            count = cache.get(self.cache_key)
+            if count is not None:
+                return count
+
+        count = self.get_estimated_count()
+        if count is None:
+            count = Paginator.count.func(self)
+
+        if self.cache_key is not None:
+            cache.set(self.cache_key, count, self.cache_timeout)
+        return count
 
 
 class PageLimitedPaginator(PageNumberPagination):
+    """Page number pagination with cached total counts.
+
+    Counts are cached for settings.PAGINATION_COUNT_CACHE_TIMEOUT seconds
+    by request path, normalized filter parameters and the catalog version,
+    so a write changing the catalog starts a new count. Views whose counts
+    depend on the current user set ``count_per_user`` or list the user
+    dependent filters in ``user_filter_params``, their counts also depend
+    on the version of the user's flags.
+    """
+
     page_size_query_param = 'limit'
+    count_cache_ignored_params = ('page', 'limit', 'recipes_limit')
+
+    def get_count_cache_key(self, request, view=None):
+        params = get_normalized_params(
+            request, ignored=self.count_cache_ignored_params)
+        per_user = getattr(view, 'count_per_user', False) or any(
+            request.query_params.get(key)
+            for key in getattr(view, 'user_filter_params', ())
+        )
+        versions = [get_catalog_version()]
+        user = None
+        if per_user and request.user.is_authenticated:
+            user = request.user.pk
+            versions.append(get_user_version(user))
+        digest = sha1(repr((versions, user, params)).encode()).hexdigest()
+        return f'pagination-count:{request.path}:{digest}'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.django_paginator_class = partial(
+            CachedCountPaginator,
+            cache_key=self.get_count_cache_key(request, view),
+            cache_timeout=settings.PAGINATION_COUNT_CACHE_TIMEOUT,
+            estimate_threshold=settings.PAGINATION_COUNT_ESTIMATE_THRESHOLD,
+        )
+        return super().paginate_queryset(queryset, request, view)
+
+
+class RecipeKeysetPaginator(BasePagination):
+    """Keyset (cursor) pagination over recipes ordered by (-pub_date, id).
+
+    Pages are selected with a WHERE condition on the position of the
+    last seen recipe instead of OFFSET, and no COUNT(*) is run. The
+    cursor is an opaque token with that position and the direction.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = 6
+    max_page_size = 100
+    ordering = ('-pub_date', 'id')
+    reverse_ordering = ('pub_date', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            decoded = urlsafe_b64decode(encoded.encode('ascii')).decode()
+            pub_date, pk, reverse = decoded.split('|')
+            return datetime.fromisoformat(pub_date), int(pk), reverse == '1'
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, item, reverse):
+        pub_date, pk = self.get_position(item)
+        token = f'{pub_date.isoformat()}|{pk}|{int(reverse)}'
+        encoded = urlsafe_b64encode(token.encode()).decode('ascii')
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, encoded)
+
+    @staticmethod
+    def get_position(item):
+        if isinstance(item, dict):
+            return item['pub_date'], item['id']
+        return item.pub_date, item.pk
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+
+        if cursor is None:
+            reverse = False
+            queryset = queryset.order_by(*self.ordering)
+        else:
+            pub_date, pk, reverse = cursor
+            if reverse:
+                queryset = queryset.filter(
+                    Q(pub_date__gt=pub_date) | Q(pub_date=pub_date, id__lt=pk)
+                ).order_by(*self.reverse_ordering)
+            else:
+                queryset = queryset.filter(
+                    Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, id__gt=pk)
+                ).order_by(*self.ordering)
+
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, cursor is not None
+
+        self.next_link = None
+        self.previous_link = None
+        if results and has_next:
+            self.next_link = self.encode_cursor(results[-1], reverse=False)
+        if results and has_previous:
+            self.previous_link = self.encode_cursor(results[0], reverse=True)
+        elif has_previous:
+            self.previous_link = remove_query_param(
+                self.base_url, self.cursor_query_param)
+        return results
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.next_link),
+            ('previous', self.previous_link),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,159 @@
+from collections import defaultdict
+from typing import Dict, Iterable, List
+
+from django.contrib.auth import get_user_model
+
+from api.lookups import get_subscription_lookup
+from recipes.images import get_rendition_urls
+from recipes.models import Recipe, RecipeIngredient
+from recipes.registry import get_recipes_tag_ids, tag_registry
+
+User = get_user_model()
+
+
+class RecipeReader:
+    """Read-only fast path for recipe list and detail responses.
+
+    Builds exactly the same representation as GetRecipeSerializer from
+    values() rows and maps loaded with one query per related model,
+    without instantiating models or DRF fields.
+    """
+
+    fields = (
+        "id",
+        "author_id",
+        "name",
+        "image",
+        "image_renditions",
+        "text",
+        "cooking_time",
+        "pub_date",
+        "favorites_count",
+    )
+    flag_fields = ("is_favorited", "is_in_shopping_cart")
+
+    def __init__(self, request=None):
+        self.request = request
+        self.image_storage = Recipe._meta.get_field("image").storage
+
+    def get_values(self, queryset):
+        fields = self.fields
+        if "is_favorited" in queryset.query.annotations:
+            fields += self.flag_fields
+        return queryset.prefetch_related(None).values(*fields)
+
+    def get_authors(self, author_ids: Iterable[int]) -> Dict[int, dict]:
+        users = User.objects.filter(pk__in=set(author_ids)).values(
+            "id",
+            "username",
+            "email",
+            "first_name",
+            "last_name",
+            "recipes_count",
+            "subscribers_count",
+        )
+        is_authenticated = (
+            self.request is not None and self.request.user.is_authenticated
+        )
+        if is_authenticated:
+            lookup = get_subscription_lookup(self.request)
+
+        authors = {}
+        for user in users:
+            authors[user["id"]] = {
+                "username": user["username"],
+                "email": user["email"],
+                "first_name": user["first_name"],
+                "last_name": user["last_name"],
+                "id": user["id"],
+                "is_subscribed": (
+                    is_authenticated and lookup.is_subscribed(user["id"])
+                ),
+                "recipes_count": user["recipes_count"],
+                "subscribers_count": user["subscribers_count"],
+            }
+        return authors
+
+    def get_ingredients(
+        self, recipe_ids: Iterable[int]
+    ) -> Dict[int, List[dict]]:
+        rows = (
+            RecipeIngredient.objects.filter(recipe_id__in=recipe_ids)
+            .order_by("pk")
+            .values_list(
+                "recipe_id",
+                "ingredient_id",
+                "ingredient__name",
+                "ingredient__measurement_unit",
+                "amount",
+            )
+        )
+        ingredients = defaultdict(list)
+        for recipe_id, pk, name, measurement_unit, amount in rows:
+            ingredients[recipe_id].append(
+                {
+                    "id": pk,
+                    "name": name,
+                    "measurement_unit": measurement_unit,
+                    "amount": amount,
+                }
+            )
+        return ingredients
+
+    def get_image_url(self, name: str):
+        if not name:
+            return None
+        url = self.image_storage.url(name)
+        if self.request is not None:
+            return self.request.build_absolute_uri(url)
+        return url
+
+    def get_image_renditions(self, renditions: dict) -> Dict[str, dict]:
+        urls = get_rendition_urls(renditions, self.image_storage)
+        if self.request is None:
+            return urls
+        return {
+            rendition: {
+                extension: self.request.build_absolute_uri(url)
+                for extension, url in rendition_urls.items()
+            }
+            for rendition, rendition_urls in urls.items()
+        }
+
+    def represent(self, rows: Iterable[dict]) -> List[dict]:
+        rows = list(rows)
+        if not rows:
+            return []
+
+        recipe_ids = [row["id"] for row in rows]
+        authors = self.get_authors(row["author_id"] for row in rows)
+        ingredients = self.get_ingredients(recipe_ids)
+        tag_ids = get_recipes_tag_ids(recipe_ids)
+
+        return [
+            {
+                "id": row["id"],
+                "author": authors[row["author_id"]],
+                "name": row["name"],
+                "tags": [
+                    {
+                        "id": tag.pk,
+                        "name": tag.name,
+                        "color": tag.color,
+                        "slug": tag.slug,
+                    }
+                    for tag in tag_registry.get_many(tag_ids[row["id"]])
+                ],
+                "ingredients": ingredients[row["id"]],
+                "image": self.get_image_url(row["image"]),
+                "image_renditions": self.get_image_renditions(
+                    row["image_renditions"]
+                ),
+                "text": row["text"],
+                "cooking_time": row["cooking_time"],
+                "is_favorited": row.get("is_favorited", False),
+                "is_in_shopping_cart": row.get("is_in_shopping_cart", False),
+                "favorites_count": row["favorites_count"],
+            }
+            for row in rows
+        ]
@@ -1,33 +1,62 @@
 import io
 import os
+import threading
+from functools import lru_cache
+from itertools import islice
+from xml.sax.saxutils import escape
 
 from django.conf import settings
 from reportlab.lib.pagesizes import A5
 from reportlab.lib.styles import ParagraphStyle
 from reportlab.lib.units import cm
 from reportlab.pdfbase import pdfmetrics, ttfonts
-from reportlab.platypus import (BaseDocTemplate, Frame, KeepTogether,
-                                PageTemplate, Paragraph)
+from reportlab.platypus import (BaseDocTemplate, Frame, PageTemplate,
+                                Paragraph)
 from rest_framework.renderers import BaseRenderer, JSONRenderer
 from rest_framework import status
 
+from recipes.shopping_lists import get_shopping_list
 
-class ShoppingListToPDFRenderer(BaseRenderer):
-    media_type = 'application/pdf'
-    format = '.pdf'
+FONT_NAME = 'Arial'
 
-    def render(self, data, accepted_media_type=None, renderer_context=None):\
+_page_templates = threading.local()
 
-        if renderer_context['response'].status_code != status.HTTP_200_OK:
-            return JSONRenderer().render(data,
-                                         accepted_media_type,
-                                         renderer_context)
 
-        buffer = io.BytesIO()
+@lru_cache(maxsize=None)
+def load_pdf_resources():
+    """Register the font and build the paragraph styles once per process.
+
+    Called from wsgi.py, so with ``gunicorn --preload`` the parsed font is
+    shared by the workers copy-on-write.
+    """
+    font = ttfonts.TTFont(FONT_NAME, os.path.join(
+        settings.STATIC_ROOT, 'fonts', 'arial.ttf'))
+    pdfmetrics.registerFont(font)
+
+    title_style = ParagraphStyle(name='Normal',
+                                 fontName=FONT_NAME,
+                                 fontSize=24,
+                                 leading=12,
+                                 spaceBefore=20,
+                                 spaceAfter=30)
+
+    text_style = ParagraphStyle(name='Normal',
+                                fontName=FONT_NAME,
+                                fontSize=14,
+                                leading=18,
+                                spaceBefore=12,
+                                spaceAfter=6)
+    return title_style, text_style
+
 
-        font = ttfonts.TTFont('Arial', os.path.join(
-            settings.STATIC_ROOT, 'fonts', 'arial.ttf'))
-        pdfmetrics.registerFont(font)
+def get_page_templates():
+    """Return page templates of the current thread.
+
+    Frames keep layout state while a document is built, so templates are
+    reused by the consecutive renders of one thread only.
+    """
+    templates = getattr(_page_templates, 'templates', None)
+    if templates is None:
         text_frame = Frame(
             x1=1.00 * cm,  # From left
             y1=1.0 * cm,  # From bottom
@@ -39,36 +68,90 @@ class ShoppingListToPDFRenderer(BaseRenderer):
             topPadding=1 * cm,
             showBoundary=1,
             id='text_frame')
-        paragraph_style = ParagraphStyle(name='Normal',
-                                         fontName='Arial',
-                                         fontSize=24,
-                                         leading=12,
-                                         spaceBefore=20,
-                                         spaceAfter=30)
-
-        text_paragraph_style = ParagraphStyle(name='Normal',
-                                              fontName='Arial',
-                                              fontSize=14,
-                                              leading=18,
-                                              spaceBefore=12,
-                                              spaceAfter=6)
-
-        L = [Paragraph("Лист покупок", paragraph_style), ]
+        templates = [PageTemplate(id='FrontPage', frames=[text_frame],
+                                  onPage=draw_page_number)]
+        _page_templates.templates = templates
+    return templates
+
+
+def draw_page_number(canvas, doc):
+    canvas.saveState()
+    canvas.setFont(FONT_NAME, 10)
+    canvas.drawRightString(A5[0] - 1.2 * cm, 0.5 * cm,
+                           str(canvas.getPageNumber()))
+    canvas.restoreState()
+
+
+class StreamingDocTemplate(BaseDocTemplate):
+    """Document template taking its story from an iterator.
+
+    Flowables are pulled in batches of ``batch_size`` while the document
+    is laid out, so only a few of them exist at any time, and page
+    content is compressed. Pages are added as long as the story lasts.
+
+    Only the flowables are streamed, see "Shopping list PDF" in the
+    README for the memory use of the finished pages.
+    """
+
+    batch_size = 50
+
+    def __init__(self, filename, **kwargs):
+        kwargs.setdefault('pageCompression', 1)
+        super().__init__(filename, **kwargs)
+
+    def _fill(self):
+        if len(self._flowables) < self.batch_size:
+            self._flowables.extend(islice(self._story, self.batch_size))
+
+    def handle_flowable(self, flowables):
+        super().handle_flowable(flowables)
+        # also called for internal lists such as the hanging flowables
+        if flowables is self._flowables:
+            self._fill()
+
+    def build_from_iterator(self, story):
+        self._story = iter(story)
+        self._flowables = []
+        self._fill()
+        self.build(self._flowables)
+
+
+class ShoppingListToPDFRenderer(BaseRenderer):
+    media_type = 'application/pdf'
+    format = '.pdf'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        response = (renderer_context or {}).get('response')
+        if (response is not None
+                and response.status_code != status.HTTP_200_OK):
+            return JSONRenderer().render(data,
+                                         accepted_media_type,
+                                         renderer_context)
+
+        buffer = io.BytesIO()
+
+        doc = StreamingDocTemplate(buffer, pagesize=A5)
+        doc.addPageTemplates(get_page_templates())
+        doc.build_from_iterator(self.get_story(data))
+        buffer.seek(0)
+        return buffer
+
+    def get_story(self, data):
+        paragraph_style, text_paragraph_style = load_pdf_resources()
+
+        yield Paragraph("Лист покупок", paragraph_style)
 
         for number, ingredient in enumerate(data):
+            name = escape(str(ingredient["ingredient__name"]))
+            unit = escape(str(ingredient["ingredient__measurement_unit"]))
             text = (f'__ {number+1}.'
-                    f' {ingredient["ingredient__name"]}'
+                    f' {name}'
                     f' - {ingredient["total"]}'
-                    f' {ingredient["ingredient__measurement_unit"]}')
-            L.append(Paragraph(text, text_paragraph_style))
-
-        story = L
-        story.append(KeepTogether([]))
-        doc = BaseDocTemplate(buffer, pagesize=A5)
-        frontpage = PageTemplate(id='FrontPage',
-                                 frames=[text_frame]
-                                 )
-        doc.addPageTemplates(frontpage)
-        doc.build(story)
-        buffer.seek(0)
-        return buffer
+                    f' {unit}')
+            yield Paragraph(text, text_paragraph_style)
+
+
+def render_shopping_list(user) -> bytes:
+    """Render the stored shopping list of a user to PDF."""
+    shopping_list = get_shopping_list(user).iterator()
+    return ShoppingListToPDFRenderer().render(shopping_list).getvalue()
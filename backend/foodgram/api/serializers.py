@@ -1,22 +1,61 @@
+from collections import defaultdict
+
 from django.contrib.auth import get_user_model
-from drf_extra_fields.fields import Base64ImageField
+from django.db import IntegrityError, transaction
+from django.db.models import Manager
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
+from rest_framework.reverse import reverse
 from rest_framework.serializers import ModelSerializer, SerializerMethodField
 
+from api.fields import (BulkPrimaryKeyRelatedField, BulkRelatedListSerializer,
+                        RecipeImageField)
+from api.lookups import get_subscription_lookup
+from recipes.images import get_rendition_urls
 from recipes.models import (
     Favorites,
     Ingredient,
     Recipe,
     RecipeIngredient,
     ShoppingCart,
+    ShoppingListJob,
     Tag,
 )
+from recipes.queries import delete_rows
+from recipes.registry import get_recipes_tag_ids, tag_registry
+from recipes.shopping_lists import refresh_recipe
+from recipes.versions import bump_catalog_version
 from users.models import Subscribe
 
 User = get_user_model()
 
 
+class UniqueCreateMixin:
+    """Creates the instance in one INSERT relying on the unique constraint
+    of the model, so concurrent duplicates fail in the database instead
+    of passing an exists() check.
+
+    An IntegrityError is reported as a duplicate only if a row with the
+    same ``unique_fields`` exists, errors raised by signal receivers of
+    the insert are not hidden behind the duplicate message.
+    """
+
+    duplicate_message = "Already exists!"
+    unique_fields = ("user", "recipe")
+
+    def create(self, validated_data):
+        try:
+            with transaction.atomic():
+                return super().create(validated_data)
+        except IntegrityError:
+            lookup = {
+                field: validated_data[field] for field in self.unique_fields
+            }
+            if not self.Meta.model.objects.filter(**lookup).exists():
+                raise
+            raise ValidationError(self.duplicate_message)
+
+
 class UserSerializer(ModelSerializer):
     is_subscribed = SerializerMethodField()
 
@@ -30,15 +69,15 @@ class UserSerializer(ModelSerializer):
             "password",
             "id",
             "is_subscribed",
+            "recipes_count",
+            "subscribers_count",
         )
         extra_kwargs = {"password": {"write_only": True}}
 
     def get_is_subscribed(self, user_obj):
-        context = self.context.get("request")
-        if context and context.user.is_authenticated:
-            return Subscribe.objects.filter(
-                user=context.user, subscribe=user_obj
-            ).exists()
+        request = self.context.get("request")
+        if request and request.user.is_authenticated:
+            return get_subscription_lookup(request).is_subscribed(user_obj.pk)
         return False
 
 
@@ -67,26 +106,58 @@ class GetRecipeIngredientSerializer(ModelSerializer):
 
 
 class CreateRecipeIngredientSerializer(ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = BulkPrimaryKeyRelatedField(queryset=Ingredient.objects.all())
 
     class Meta:
         model = RecipeIngredient
         fields = ("id", "amount")
+        list_serializer_class = BulkRelatedListSerializer
+
+
+class ImageRenditionsMixin:
+    def get_image_renditions(self, recipe):
+        urls = get_rendition_urls(
+            recipe.image_renditions, recipe.image.storage
+        )
+        request = self.context.get("request")
+        if request is None:
+            return urls
+        return {
+            rendition: {
+                extension: request.build_absolute_uri(url)
+                for extension, url in rendition_urls.items()
+            }
+            for rendition, rendition_urls in urls.items()
+        }
 
 
-class RecipeDescriptionSerializer(ModelSerializer):
+class RecipeDescriptionSerializer(ImageRenditionsMixin, ModelSerializer):
+    image_renditions = SerializerMethodField()
+
     class Meta:
         model = Recipe
-        fields = ("id", "name", "image", "cooking_time")
+        fields = ("id", "name", "image", "image_renditions", "cooking_time")
         read_only_fields = ("id", "name", "image", "cooking_time")
 
 
-class GetRecipeSerializer(ModelSerializer):
+class GetRecipeListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        recipes = list(data.all() if isinstance(data, Manager) else data)
+        recipes_tag_ids = get_recipes_tag_ids(
+            recipe.pk for recipe in recipes
+        )
+        for recipe in recipes:
+            recipe.tag_ids = recipes_tag_ids[recipe.pk]
+        return super().to_representation(recipes)
+
+
+class GetRecipeSerializer(ImageRenditionsMixin, ModelSerializer):
     author = UserSerializer(read_only=True)
-    tags = TagSerializer(many=True, source="tag")
+    tags = SerializerMethodField()
     ingredients = GetRecipeIngredientSerializer(many=True)
     is_favorited = SerializerMethodField()
     is_in_shopping_cart = SerializerMethodField()
+    image_renditions = SerializerMethodField()
 
     class Meta:
         model = Recipe
@@ -97,14 +168,27 @@ class GetRecipeSerializer(ModelSerializer):
             "tags",
             "ingredients",
             "image",
+            "image_renditions",
             "text",
             "cooking_time",
             "is_favorited",
             "is_in_shopping_cart",
+            "favorites_count",
         )
         read_only_fields = ("id",)
+        list_serializer_class = GetRecipeListSerializer
+
+    def get_tags(self, recipe):
+        tag_ids = getattr(recipe, "tag_ids", None)
+        if tag_ids is None:
+            tag_ids = get_recipes_tag_ids([recipe.pk])[recipe.pk]
+        return TagSerializer(tag_registry.get_many(tag_ids), many=True).data
 
     def get_is_favorited(self, recipe):
+        is_favorited = getattr(recipe, "is_favorited", None)
+        if is_favorited is not None:
+            return is_favorited
+
         if self.context.get("request") is None:
             return False
 
@@ -115,6 +199,10 @@ class GetRecipeSerializer(ModelSerializer):
             return current_user.favorites.filter(recipe=recipe).exists()
 
     def get_is_in_shopping_cart(self, recipe):
+        is_in_shopping_cart = getattr(recipe, "is_in_shopping_cart", None)
+        if is_in_shopping_cart is not None:
+            return is_in_shopping_cart
+
         if self.context.get("request") is None:
             return False
 
@@ -126,11 +214,9 @@ class GetRecipeSerializer(ModelSerializer):
 
 
 class CreateRecipeSerializer(ModelSerializer):
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(), many=True
-    )
+    tags = BulkPrimaryKeyRelatedField(queryset=Tag.objects.all(), many=True)
     ingredients = CreateRecipeIngredientSerializer(many=True)
-    image = Base64ImageField(required=False)
+    image = RecipeImageField(required=False)
 
     class Meta:
         model = Recipe
@@ -167,18 +253,70 @@ class CreateRecipeSerializer(ModelSerializer):
 
         self.create_new_ingredients(new_recipe, ingredients)
         new_recipe.tag.add(*tags)
+        bump_catalog_version()
         return new_recipe
 
+    def update_ingredients(self, recipe, new_ingredients):
+        """Insert, update and delete only the changed ingredients of the
+        recipe and return ids of the changed ingredients."""
+        amounts = {
+            ingredient["id"].pk: ingredient["amount"]
+            for ingredient in new_ingredients
+        }
+        current = {
+            recipe_ingredient.ingredient_id: recipe_ingredient
+            for recipe_ingredient in RecipeIngredient.objects.filter(
+                recipe=recipe
+            )
+        }
+
+        deleted = [
+            recipe_ingredient.pk
+            for ingredient_id, recipe_ingredient in current.items()
+            if ingredient_id not in amounts
+        ]
+        changed = []
+        created = []
+        for ingredient_id, amount in amounts.items():
+            recipe_ingredient = current.get(ingredient_id)
+            if recipe_ingredient is None:
+                created.append(
+                    RecipeIngredient(
+                        recipe=recipe,
+                        ingredient_id=ingredient_id,
+                        amount=amount,
+                    )
+                )
+            elif recipe_ingredient.amount != amount:
+                recipe_ingredient.amount = amount
+                changed.append(recipe_ingredient)
+
+        if deleted:
+            # one DELETE without per-row signals, their work is done by
+            # the caller for all changed ingredients at once
+            delete_rows(RecipeIngredient.objects.filter(pk__in=deleted))
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ["amount"])
+        if created:
+            RecipeIngredient.objects.bulk_create(created)
+
+        changed_ids = current.keys() ^ amounts.keys()
+        return changed_ids | {
+            recipe_ingredient.ingredient_id for recipe_ingredient in changed
+        }
+
+    @transaction.atomic
     def update(self, instance: Recipe, validated_data):
-        instance.ingredients.filter(recipe=instance).delete()
-        self.create_new_ingredients(
+        changed_ingredient_ids = self.update_ingredients(
             instance, validated_data.pop("ingredients")
         )
+        instance.tag.set(validated_data.pop("tags"))
 
-        tags = validated_data.pop("tags")
-        instance.tag.set(tags, clear=True)
-
-        return super().update(instance, validated_data)
+        instance = super().update(instance, validated_data)
+        if changed_ingredient_ids:
+            refresh_recipe(instance.pk, changed_ingredient_ids)
+        bump_catalog_version()
+        return instance
 
     def validate(self, data):
         new_ingredints_in_recipe: dict[str, str] = data["ingredients"]
@@ -192,7 +330,27 @@ class CreateRecipeSerializer(ModelSerializer):
         return super().validate(data)
 
 
-class SubscribeSerializer(ModelSerializer):
+class SubscribeListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        subscribes = list(data.all() if isinstance(data, Manager) else data)
+        request = self.context.get("request")
+        if subscribes and request is not None:
+            limit = request.GET.get("recipes_limit")
+            recipes = Recipe.objects.latest_for_authors(
+                [subscribe.subscribe_id for subscribe in subscribes],
+                int(limit) if limit else None,
+            )
+            recipes_by_author = defaultdict(list)
+            for recipe in recipes:
+                recipes_by_author[recipe.author_id].append(recipe)
+            for subscribe in subscribes:
+                subscribe.recipes_preview = recipes_by_author[
+                    subscribe.subscribe_id
+                ]
+        return super().to_representation(subscribes)
+
+
+class SubscribeSerializer(UniqueCreateMixin, ModelSerializer):
     email = serializers.ReadOnlyField(source="subscribe.email")
     id = serializers.ReadOnlyField(source="subscribe.id")
     username = serializers.ReadOnlyField(source="subscribe.username")
@@ -221,14 +379,23 @@ class SubscribeSerializer(ModelSerializer):
             "user": {"write_only": True},
             "subscribe": {"write_only": True},
         }
+        list_serializer_class = SubscribeListSerializer
+        validators = []
+
+    duplicate_message = "This subscription is already registered"
+    unique_fields = ("user", "subscribe")
 
     def get_is_subscribed(self, subscribe_obj: Subscribe):
         return True
 
     def get_recipes_count(self, subscribe_obj: Subscribe):
-        return subscribe_obj.subscribe.recipes.count()
+        return subscribe_obj.subscribe.recipes_count
 
     def get_recipes(self, subscribe_obj: Subscribe):
+        recipes = getattr(subscribe_obj, "recipes_preview", None)
+        if recipes is not None:
+            return RecipeDescriptionSerializer(recipes, many=True).data
+
         limit = self.context["request"].GET.get("recipes_limit")
         if limit:
             recipes = Recipe.objects.filter(author=subscribe_obj.subscribe)[
@@ -247,18 +414,21 @@ class SubscribeSerializer(ModelSerializer):
             if not limit.isnumeric():
                 raise ValidationError("recipes_limit must be a number!")
 
-        if Subscribe.objects.filter(
-            user=current_user, subscribe=subscribe_user
-        ).exists():
-            raise ValidationError("This subscription is already registered")
-
         if subscribe_user == current_user:
             raise ValidationError("Subscribing to yourself is not allowed!")
 
         return attrs
 
 
-class FavoritesSerializer(ModelSerializer):
+class RecipeIdsSerializer(serializers.Serializer):
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100,
+    )
+
+
+class FavoritesSerializer(UniqueCreateMixin, ModelSerializer):
     id = serializers.ReadOnlyField(source="recipe.id")
     name = serializers.CharField(source="recipe.name", read_only=True)
     image = serializers.CharField(source="recipe.image", read_only=True)
@@ -272,16 +442,10 @@ class FavoritesSerializer(ModelSerializer):
             "recipe": {"write_only": True},
         }
 
-    def validate(self, attrs):
-        user = attrs["user"]
-        recipe = attrs["recipe"]
-
-        if Favorites.objects.filter(recipe=recipe, user=user).exists():
-            raise ValidationError("Already added to favorites!")
-        return attrs
+    duplicate_message = "Already added to favorites!"
 
 
-class ShoppingCartSerializer(ModelSerializer):
+class ShoppingCartSerializer(UniqueCreateMixin, ModelSerializer):
     id = serializers.ReadOnlyField(source="recipe.id")
     name = serializers.CharField(source="recipe.name", read_only=True)
     image = serializers.CharField(source="recipe.image", read_only=True)
@@ -295,11 +459,19 @@ class ShoppingCartSerializer(ModelSerializer):
             "recipe": {"write_only": True},
         }
 
-    def validate(self, attrs):
-        recipe = attrs["recipe"]
-        user = attrs["user"]
+    duplicate_message = "Already added to shopping cart!"
 
-        if ShoppingCart.objects.filter(recipe=recipe, user=user).exists():
-            raise ValidationError("Already added to shopping cart!")
 
-        return attrs
+class ShoppingListJobSerializer(ModelSerializer):
+    url = SerializerMethodField()
+
+    class Meta:
+        model = ShoppingListJob
+        fields = ("id", "status", "created", "finished", "url")
+
+    def get_url(self, obj: ShoppingListJob):
+        return reverse(
+            "shopping_list_job",
+            kwargs={"job_id": obj.pk},
+            request=self.context.get("request"),
+        )
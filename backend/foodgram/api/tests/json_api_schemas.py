@@ -13,6 +13,9 @@ def schema_to_strict(schema: dict) -> dict:
     if schema["type"] not in ["object", "array"]:
         return schema
 
+    if schema["type"] == "object" and "properties" not in schema:
+        return schema
+
     if schema["type"] == "array":
         schema["items"] = schema_to_strict(schema["items"])
         return schema
@@ -34,6 +37,8 @@ USER_RESPONSE_JSON_SCHEMA = {
         "first_name": {"type": "string"},
         "last_name": {"type": "string"},
         "is_subscribed": {"type": "boolean"},
+        "recipes_count": {"type": "integer"},
+        "subscribers_count": {"type": "integer"},
     },
     "required": [],
 }
@@ -90,6 +95,19 @@ INGREDIENT_ARRAY_RESPONSE_API_SCHEMA = {
 schema_to_strict(INGREDIENT_ARRAY_RESPONSE_API_SCHEMA)
 
 
+IMAGE_RENDITIONS_JSON_SCHEMA = {
+    "type": "object",
+    "additionalProperties": {
+        "type": "object",
+        "properties": {
+            "webp": {"type": "string"},
+            "jpeg": {"type": "string"},
+        },
+        "required": ["webp", "jpeg"],
+    },
+}
+
+
 RECIPE_RESPONSE_JSON_SCHEMA = {
     "type": "object",
     "properties": {
@@ -101,8 +119,10 @@ RECIPE_RESPONSE_JSON_SCHEMA = {
         "is_in_shopping_cart": {"type": "boolean"},
         "name": {"type": "string"},
         "image": {"type": "string"},
+        "image_renditions": IMAGE_RENDITIONS_JSON_SCHEMA,
         "text": {"type": "string"},
         "cooking_time": {"type": "integer"},
+        "favorites_count": {"type": "integer"},
     },
 }
 
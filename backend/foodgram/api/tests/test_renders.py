@@ -0,0 +1,56 @@
+import re
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+from rest_framework.response import Response
+
+from api.renders import ShoppingListToPDFRenderer, StreamingDocTemplate
+
+
+def generate_shopping_list(lines_count: int):
+    for number in range(lines_count):
+        yield {
+            "ingredient__name": f"ingredient <{number}> & co",
+            "ingredient__measurement_unit": "g",
+            "total": number,
+        }
+
+
+class TestShoppingListToPDFRenderer(SimpleTestCase):
+    def render(self, lines_count: int) -> bytes:
+        return (
+            ShoppingListToPDFRenderer()
+            .render(
+                generate_shopping_list(lines_count),
+                renderer_context={"response": Response()},
+            )
+            .getvalue()
+        )
+
+    def test_render_sizes(self):
+        max_pending = []
+        fill = StreamingDocTemplate._fill
+
+        def tracking_fill(doc):
+            fill(doc)
+            max_pending.append(len(doc._flowables))
+
+        pages_count = {}
+        for lines_count in (10, 1_000, 10_000):
+            with self.subTest(lines_count=lines_count), patch.object(
+                StreamingDocTemplate, "_fill", tracking_fill
+            ):
+                max_pending.clear()
+                pdf = self.render(lines_count)
+                self.assertTrue(pdf.startswith(b"%PDF"))
+                pages_count[lines_count] = len(
+                    re.findall(rb"/Type /Page\b(?!s)", pdf)
+                )
+                # the story is never held in memory as a whole
+                self.assertLessEqual(
+                    max(max_pending), 2 * StreamingDocTemplate.batch_size
+                )
+
+        self.assertEqual(pages_count[10], 1)
+        self.assertGreater(pages_count[1_000], 1_000 // 20)
+        self.assertGreater(pages_count[10_000], 10 * pages_count[1_000] - 10)
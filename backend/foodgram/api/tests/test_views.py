@@ -1,32 +1,78 @@
+import json
+import os
 import shutil
 import tempfile
+import tracemalloc
+from base64 import b64encode
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest.mock import patch
+
 from django.conf import settings
-from django.test import TestCase, override_settings
-from rest_framework.test import APIClient as Client
 from django.contrib.auth import get_user_model
-from recipes.models import Tag, Ingredient, Recipe, RecipeIngredient
-from users.models import Subscribe
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
 from rest_framework import status
 from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient as Client
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.cache import get_shopping_cart_hash
+from api.fields import RecipeImageField
+from api.jobs import claim_shopping_list_job, requeue_stale_shopping_list_jobs
+from api.lookups import SubscriptionLookup
+from api.serializers import (
+    CreateRecipeSerializer,
+    GetRecipeSerializer,
+    IngredientSerializer,
+    SubscribeSerializer,
+    TagSerializer,
+    UserSerializer,
+)
+from api.views import FavoritesBulkView, RecipeViewSet
+from recipes import Setup
+from recipes.images import (
+    RENDITION_FORMATS,
+    iter_rendition_names,
+    process_recipe_image,
+)
+from recipes.jobs import TASKS, requeue_stale_recipe_jobs, run_recipe_job
+from recipes.models import (
+    Favorites,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    RecipeJob,
+    ShoppingCart,
+    ShoppingListItem,
+    ShoppingListJob,
+    Tag,
+)
+from recipes.registry import TagRegistry, ingredient_index, tag_registry
+from recipes.versions import get_catalog_version
+from users.models import Subscribe
+
 from .json_api_schemas import (
     RECIPE_RESPONSE_JSON_SCHEMA,
     RECIPES_PAGINATED_RESPONCE_JSON_SCHEMA,
 )
 from .utils import (
-    create_image,
     authorize_client_by_user,
+    create_image,
     get_byte_64_image,
-    test_recipe_content,
     test_json_schema,
+    test_recipe_content,
 )
-from django.urls import reverse
-from api.serializers import (
-    IngredientSerializer,
-    TagSerializer,
-    UserSerializer,
-    SubscribeSerializer,
-)
-import json
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.MEDIA_ROOT)
 
@@ -67,6 +113,47 @@ class TestIngredientsView(TestCase):
         ).data
         self.assertEqual(response_data, expected_data)
 
+    def test_search(self):
+        names = ("vanilla sugar", "Sugar", "salt", "sugar powder")
+        ingredients = {
+            name: Ingredient.objects.create(name=name, measurement_unit="g")
+            for name in names
+        }
+
+        ingredient_index.warm()
+        with self.assertNumQueries(0):
+            response_data = self.client.get(
+                reverse("ingredients-list"), data={"name": "SUG"}
+            ).data
+
+        expected_data = IngredientSerializer(
+            [
+                ingredients["Sugar"],
+                ingredients["sugar powder"],
+                ingredients["vanilla sugar"],
+            ],
+            many=True,
+        ).data
+        self.assertEqual(response_data, expected_data)
+
+        response_data = self.client.get(
+            reverse("ingredients-list"), data={"name": "SUG", "fuzzy": 1}
+        ).data
+        self.assertEqual(response_data, expected_data)
+
+        with self.settings(INGREDIENT_SEARCH_IN_MEMORY=False):
+            response_data = self.client.get(
+                reverse("ingredients-list"), data={"name": "SUG"}
+            ).data
+        self.assertEqual(response_data, expected_data[:2])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredients["salt"].delete()
+        response_data = self.client.get(
+            reverse("ingredients-list"), data={"name": "sa"}
+        ).data
+        self.assertEqual(response_data, [])
+
 
 class TestTagsView(TestCase):
     @classmethod
@@ -86,6 +173,39 @@ class TestTagsView(TestCase):
         expected_data = TagSerializer(instance=TestTagsView.tag).data
         self.assertEqual(response_data, expected_data)
 
+    def test_list_served_from_registry(self):
+        tag_registry.warm()
+        with self.assertNumQueries(0):
+            self.client.get(reverse("tags-list"))
+            self.client.get(
+                reverse("tags-detail", kwargs={"pk": TestTagsView.tag.pk})
+            )
+
+    def test_registry_invalidation(self):
+        tag_registry.warm()
+        # the registry of another worker process, which gets no signals
+        other_registry = TagRegistry()
+        other_registry.warm()
+        with self.captureOnCommitCallbacks(execute=True):
+            new_tag = Tag.objects.create(
+                name="new_name", slug="new_slug", color="#000000"
+            )
+        response_data = self.client.get(reverse("tags-list")).data
+        self.assertIn(new_tag.slug, [tag["slug"] for tag in response_data])
+        self.assertIn(
+            new_tag.slug, dict(other_registry.slug_choices())
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            new_tag.delete()
+        self.assertNotIn(
+            new_tag.slug, dict(other_registry.slug_choices())
+        )
+        response = self.client.get(
+            reverse("tags-detail", kwargs={"pk": new_tag.pk})
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
 
 class TestUsersView(TestCase):
     @classmethod
@@ -126,6 +246,49 @@ class TestUsersView(TestCase):
         expected_data = UserSerializer(instance=TestUsersView.user_1).data
         self.assertEqual(response_data, expected_data)
 
+    def test_list_is_subscribed(self):
+        Subscribe.objects.create(
+            user=TestUsersView.user_1, subscribe=TestUsersView.author_user
+        )
+        for number in range(3):
+            User.objects.create(
+                email=f"extra-{number}@email.com", username=f"extra_{number}"
+            )
+
+        with CaptureQueriesContext(connection) as queries:
+            response = TestUsersView.user_1_client.get(reverse("user-list"))
+
+        subscribe_queries = [
+            query
+            for query in queries.captured_queries
+            if "users_subscribe" in query["sql"]
+        ]
+        self.assertEqual(len(subscribe_queries), 1)
+        subscribed = {
+            user["id"]: user["is_subscribed"] for user in response.data
+        }
+        self.assertTrue(subscribed.pop(TestUsersView.author_user.id))
+        self.assertFalse(any(subscribed.values()))
+
+    def test_subscription_lookup_bounded(self):
+        authors = [
+            User.objects.create(
+                email=f"author-{number}@email.com",
+                username=f"author_{number}",
+            )
+            for number in range(3)
+        ]
+        for author in authors:
+            Subscribe.objects.create(
+                user=TestUsersView.user_1, subscribe=author
+            )
+
+        lookup = SubscriptionLookup(TestUsersView.user_1, max_size=2)
+        for author in authors:
+            self.assertTrue(lookup.is_subscribed(author.id))
+        self.assertFalse(lookup.is_subscribed(TestUsersView.author_user.id))
+        self.assertLessEqual(len(lookup._memo), 2)
+
     def test_register_new_user(self):
         client = Client()
         reg_data = {
@@ -141,6 +304,7 @@ class TestUsersView(TestCase):
 
 class TestSubscribeView(TestCase):
     def setUp(self) -> None:
+        cache.clear()
         self.user_1 = User.objects.create(
             email="some-email@email.com", username="some_name"
         )
@@ -166,6 +330,18 @@ class TestSubscribeView(TestCase):
             ).exists()
         )
 
+    def test_create_subscribe_twice(self):
+        url = reverse("subscribe", kwargs={"user_id": self.author_user.pk})
+        self.user_1_client.post(url)
+        response = self.user_1_client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            Subscribe.objects.filter(
+                user=self.user_1, subscribe=self.author_user
+            ).count(),
+            1,
+        )
+
     def test_remove_subscribe(self):
         Subscribe.objects.create(user=self.user_1, subscribe=self.author_user)
         self.assertTrue(
@@ -192,6 +368,47 @@ class TestSubscribeView(TestCase):
         ).data
         self.assertEqual(resp.data, expected_data)
 
+    def test_subscriptions_list_recipes_limit(self):
+        authors = [self.author_user] + [
+            User.objects.create(
+                email=f"author-{number}@email.com",
+                username=f"author_{number}",
+            )
+            for number in range(2)
+        ]
+        for author in authors:
+            Subscribe.objects.create(user=self.user_1, subscribe=author)
+            for number in range(3):
+                Recipe.objects.create(
+                    author=author,
+                    name=f"{author.username}_recipe_{number}",
+                    text="some_text",
+                    image=f"recipes/{author.username}_{number}.png",
+                    cooking_time=1,
+                )
+
+        request = APIRequestFactory().get(
+            reverse("subscriptions"), data={"recipes_limit": 2}
+        )
+        expected_data = [
+            SubscribeSerializer(subscribe, context={"request": request}).data
+            for subscribe in Subscribe.objects.filter(
+                user=self.user_1
+            ).order_by("id")
+        ]
+
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.user_1_client.get(
+                reverse("subscriptions"),
+                data={"recipes_limit": 2, "limit": 10},
+            )
+
+        self.assertEqual(resp.data["results"], expected_data)
+        self.assertEqual(len(resp.data["results"][0]["recipes"]), 2)
+        self.assertEqual(resp.data["results"][0]["recipes_count"], 3)
+        # token, count, page and recipes previews
+        self.assertEqual(len(queries), 4)
+
 
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
 class TestRecipeView(TestCase):
@@ -250,6 +467,7 @@ class TestRecipeView(TestCase):
 
         self.usual_client = Client()
         authorize_client_by_user(self.usual_client, TestRecipeView.usual_user)
+        cache.clear()
 
     def test_recipe_creation(self):
         recipe_data = {
@@ -343,6 +561,1436 @@ class TestRecipeView(TestCase):
             self, RECIPES_PAGINATED_RESPONCE_JSON_SCHEMA, response.data
         )
 
+    def test_recipes_list_user_flags(self):
+        Favorites.objects.create(
+            user=TestRecipeView.usual_user, recipe=TestRecipeView.test_recipe
+        )
+
+        response = self.usual_client.get(
+            reverse("recipe-list"), data={"limit": 1}
+        )
+        recipe_data = response.data["results"][0]
+        self.assertTrue(recipe_data["is_favorited"])
+        self.assertFalse(recipe_data["is_in_shopping_cart"])
+
+        ShoppingCart.objects.create(
+            user=TestRecipeView.usual_user, recipe=TestRecipeView.test_recipe
+        )
+        response = self.usual_client.get(
+            reverse(
+                "recipe-detail", kwargs={"pk": TestRecipeView.test_recipe.pk}
+            )
+        )
+        self.assertTrue(response.data["is_in_shopping_cart"])
+
+        response = self.client.get(reverse("recipe-list"), data={"limit": 1})
+        recipe_data = response.data["results"][0]
+        self.assertFalse(recipe_data["is_favorited"])
+        self.assertFalse(recipe_data["is_in_shopping_cart"])
+
+    def test_recipes_list_tags(self):
+        response = self.client.get(
+            reverse("recipe-list"), data={"limit": 1, "tags": "tag_2"}
+        )
+        self.assertEqual(response.data["count"], 1)
+        self.assertEqual(
+            response.data["results"][0]["tags"],
+            TagSerializer(TestRecipeView.tags, many=True).data,
+        )
+
+        response = self.client.get(
+            reverse("recipe-list"), data={"tags": "unknown_tag"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_recipe_reader_matches_serializer(self):
+        Favorites.objects.create(
+            user=TestRecipeView.usual_user, recipe=TestRecipeView.test_recipe
+        )
+        Subscribe.objects.create(
+            user=TestRecipeView.usual_user,
+            subscribe=TestRecipeView.author_user,
+        )
+        Recipe.objects.create(
+            author=TestRecipeView.usual_user,
+            name="second recipe",
+            text="some_text",
+            image=create_image(),
+            cooking_time=5,
+        ).tag.set(TestRecipeView.tags[1:])
+
+        url = reverse("recipe-list")
+        request = APIRequestFactory().get(url)
+        request.user = TestRecipeView.usual_user
+        recipes = Recipe.objects.with_user_flags(request.user)
+        renderer = JSONRenderer()
+
+        response = self.usual_client.get(url, data={"limit": 10})
+        test_json_schema(
+            self, RECIPES_PAGINATED_RESPONCE_JSON_SCHEMA, response.data
+        )
+        self.assertEqual(
+            renderer.render(response.data["results"]),
+            renderer.render(
+                GetRecipeSerializer(
+                    recipes, many=True, context={"request": request}
+                ).data
+            ),
+        )
+
+        response = self.usual_client.get(
+            reverse(
+                "recipe-detail", kwargs={"pk": TestRecipeView.test_recipe.pk}
+            )
+        )
+        self.assertEqual(
+            response.content,
+            renderer.render(
+                GetRecipeSerializer(
+                    recipes.get(pk=TestRecipeView.test_recipe.pk),
+                    context={"request": request},
+                ).data
+            ),
+        )
+
+    def test_recipes_list_cached_count(self):
+        url = reverse("recipe-list")
+        response = self.usual_client.get(
+            f"{url}?limit=1&tags=tag_1&tags=tag_2"
+        )
+        self.assertEqual(response.data["count"], 1)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                f"{url}?tags=tag_2&tags=tag_1&limit=2&page=1"
+            )
+        self.assertEqual(response.data["count"], 1)
+        self.assertFalse(
+            [
+                query
+                for query in queries.captured_queries
+                if "COUNT(" in query["sql"]
+            ]
+        )
+
+        # a write to the catalog starts a new count, the last page is not
+        # cut at the old one
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.objects.create(
+                author=TestRecipeView.usual_user,
+                name="new recipe",
+                text="some_text",
+                image="recipes/new_recipe.png",
+                cooking_time=1,
+            ).tag.set(TestRecipeView.tags)
+        response = self.client.get(f"{url}?tags=tag_2&tags=tag_1&limit=1")
+        self.assertEqual(response.data["count"], 2)
+        self.assertIsNotNone(response.data["next"])
+        response = self.client.get(
+            f"{url}?tags=tag_2&tags=tag_1&limit=1&page=2"
+        )
+        self.assertEqual(
+            [recipe["id"] for recipe in response.data["results"]],
+            [TestRecipeView.test_recipe.pk],
+        )
+
+        data = {"limit": 1, "tags": "tag_1", "is_favorited": 1}
+        self.assertEqual(self.usual_client.get(url, data).data["count"], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorites.objects.create(
+                user=TestRecipeView.usual_user,
+                recipe=TestRecipeView.test_recipe,
+            )
+        self.assertEqual(self.usual_client.get(url, data).data["count"], 1)
+
+    def test_anonymous_response_cache(self):
+        url = reverse(
+            "recipe-detail", kwargs={"pk": TestRecipeView.test_recipe.pk}
+        )
+        self.assertEqual(self.client.get(url).data["name"], "test recipe")
+
+        # writes bypassing signals are not seen until the version changes
+        Recipe.objects.filter(pk=TestRecipeView.test_recipe.pk).update(
+            name="changed name"
+        )
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.data["name"], "test recipe")
+        self.assertEqual(
+            self.usual_client.get(url).data["name"], "changed name"
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author_client.patch(
+                url,
+                data=json.dumps(
+                    {
+                        "name": "patched name",
+                        "text": "some_text",
+                        "cooking_time": 2,
+                        "tags": [TestRecipeView.tags[0].pk],
+                        "ingredients": [
+                            {
+                                "id": TestRecipeView.ingredients[0].pk,
+                                "amount": 1,
+                            }
+                        ],
+                    }
+                ),
+                content_type="application/json",
+            )
+        self.assertEqual(self.client.get(url).data["name"], "patched name")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author_client.delete(url)
+        self.assertEqual(
+            self.client.get(url).status_code, status.HTTP_404_NOT_FOUND
+        )
+
+    def test_conditional_get(self):
+        url = reverse(
+            "recipe-detail", kwargs={"pk": TestRecipeView.test_recipe.pk}
+        )
+        response = self.usual_client.get(url)
+        etag = response["ETag"]
+        self.assertTrue(etag.startswith('"'))
+
+        # token authentication only
+        with self.assertNumQueries(1):
+            response = self.usual_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["ETag"], etag)
+
+        response = self.usual_client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # other users and anonymous clients get their own validators
+        self.assertNotEqual(self.author_client.get(url)["ETag"], etag)
+        self.assertNotEqual(self.client.get(url)["ETag"], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.usual_client.post(
+                reverse(
+                    "favorite",
+                    kwargs={"recipe_id": TestRecipeView.test_recipe.pk},
+                )
+            )
+        response = self.usual_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data["is_favorited"])
+
+        for url in (reverse("tags-list"), reverse("ingredients-list")):
+            with self.subTest(url=url):
+                etag = self.client.get(url)["ETag"]
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(
+                    response.status_code, status.HTTP_304_NOT_MODIFIED
+                )
+
+    def test_counters_keep_catalog_validators(self):
+        recipe = TestRecipeView.test_recipe
+        other_recipe = Recipe.objects.create(
+            author=TestRecipeView.usual_user,
+            name="other recipe",
+            text="some_text",
+            image="recipes/other.png",
+            cooking_time=1,
+        )
+        detail_url = reverse("recipe-detail", kwargs={"pk": recipe.pk})
+        other_url = reverse("recipe-detail", kwargs={"pk": other_recipe.pk})
+        tags_url = reverse("tags-list")
+        ingredients_url = reverse("ingredients-list")
+        self.client.get(detail_url)
+        etags = {
+            url: self.client.get(url)["ETag"]
+            for url in (detail_url, other_url, tags_url, ingredients_url)
+        }
+        catalog_version = get_catalog_version()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author_client.post(
+                reverse("favorite", kwargs={"recipe_id": recipe.pk})
+            )
+        self.assertEqual(get_catalog_version(), catalog_version)
+        for url in (other_url, tags_url, ingredients_url):
+            with self.subTest(url=url):
+                response = self.client.get(
+                    url, HTTP_IF_NONE_MATCH=etags[url]
+                )
+                self.assertEqual(
+                    response.status_code, status.HTTP_304_NOT_MODIFIED
+                )
+
+        # the cached anonymous body of the favorited recipe is built again
+        response = self.client.get(
+            detail_url, HTTP_IF_NONE_MATCH=etags[detail_url]
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["favorites_count"], 1)
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                detail_url, HTTP_IF_NONE_MATCH=response["ETag"]
+            )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author_client.post(
+                reverse(
+                    "subscribe",
+                    kwargs={"user_id": TestRecipeView.usual_user.pk},
+                )
+            )
+        self.assertEqual(
+            self.client.get(other_url).data["author"]["subscribers_count"], 1
+        )
+
+    def test_download_shopping_cart(self):
+        ShoppingCart.objects.create(
+            user=TestRecipeView.usual_user, recipe=TestRecipeView.test_recipe
+        )
+        # the second render reuses the loaded font and page templates
+        for _ in range(2):
+            response = self.usual_client.get(reverse("shopping_cart"))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(
+                response["Content-Type"].startswith("application/pdf")
+            )
+            self.assertTrue(response.content.startswith(b"%PDF"))
+
+        response = self.usual_client.get(
+            reverse("shopping_cart"), HTTP_ACCEPT="application/json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.content.startswith(b"%PDF"))
+
+    @staticmethod
+    def reads_shopping_list(queries):
+        return any(
+            query["sql"].startswith("SELECT")
+            and "recipes_shoppinglistitem" in query["sql"]
+            for query in queries
+        )
+
+    def test_download_shopping_cart_cache(self):
+        url = reverse("shopping_cart")
+
+        def download():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.usual_client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIn("attachment;", response["Content-Disposition"])
+            return response.content, self.reads_shopping_list(queries)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ShoppingCart.objects.create(
+                user=TestRecipeView.usual_user,
+                recipe=TestRecipeView.test_recipe,
+            )
+        document, rendered = download()
+        self.assertTrue(rendered)
+        self.assertEqual(download(), (document, False))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe_ingredient = TestRecipeView.recipe_ingredients[0]
+            recipe_ingredient.amount = 10
+            recipe_ingredient.save()
+        document, rendered = download()
+        self.assertTrue(rendered)
+        self.assertEqual(download(), (document, False))
+
+        other_recipe = Recipe.objects.create(
+            author=TestRecipeView.author_user,
+            name="other recipe",
+            text="some_text",
+            image="recipes/other.png",
+            cooking_time=1,
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            ShoppingCart.objects.create(
+                user=TestRecipeView.usual_user, recipe=other_recipe
+            )
+        self.assertTrue(download()[1])
+
+        # other users get their own documents
+        with self.captureOnCommitCallbacks(execute=True):
+            ShoppingCart.objects.create(
+                user=TestRecipeView.author_user,
+                recipe=TestRecipeView.test_recipe,
+            )
+        with CaptureQueriesContext(connection) as queries:
+            self.author_client.get(url)
+        self.assertTrue(self.reads_shopping_list(queries))
+
+    def test_download_shopping_cart_async(self):
+        ShoppingCart.objects.create(
+            user=TestRecipeView.usual_user, recipe=TestRecipeView.test_recipe
+        )
+        response = self.usual_client.get(
+            reverse("shopping_cart"), data={"async": "true"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(response.data["status"], "pending")
+        job_url = response.data["url"]
+
+        # the status is JSON whatever the client accepts
+        for accept in ("application/json", "application/pdf"):
+            with self.subTest(accept=accept):
+                for url in (reverse("shopping_cart"), job_url):
+                    response = self.usual_client.get(
+                        url, data={"async": "true"}, HTTP_ACCEPT=accept
+                    )
+                    self.assertEqual(
+                        response.status_code, status.HTTP_202_ACCEPTED
+                    )
+                    self.assertEqual(
+                        response["Content-Type"], "application/json"
+                    )
+
+        # repeated requests of the same cart reuse the job
+        self.assertEqual(
+            self.usual_client.get(
+                reverse("shopping_cart"), data={"async": "true"}
+            ).data["id"],
+            response.data["id"],
+        )
+        self.assertEqual(
+            self.usual_client.get(job_url).status_code,
+            status.HTTP_202_ACCEPTED,
+        )
+        self.assertEqual(
+            self.author_client.get(job_url).status_code,
+            status.HTTP_404_NOT_FOUND,
+        )
+
+        call_command("render_shopping_lists", "--once", stdout=StringIO())
+        response = self.usual_client.get(
+            job_url, HTTP_ACCEPT="application/pdf"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/pdf")
+        self.assertIn("attachment;", response["Content-Disposition"])
+        self.assertTrue(response.content.startswith(b"%PDF"))
+
+        with override_settings(SHOPPING_LIST_RENDER_ASYNC=True):
+            response = self.usual_client.get(reverse("shopping_cart"))
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            self.assertEqual(response.data["status"], "done")
+            response = self.usual_client.get(
+                reverse("shopping_cart"), data={"async": "false"}
+            )
+            self.assertTrue(response.content.startswith(b"%PDF"))
+
+    @override_settings(
+        SHOPPING_LIST_JOB_TIMEOUT=60, SHOPPING_LIST_JOB_MAX_ATTEMPTS=2
+    )
+    def test_stale_shopping_list_job(self):
+        job = ShoppingListJob.objects.create(
+            user=TestRecipeView.usual_user,
+            content_hash=get_shopping_cart_hash(TestRecipeView.usual_user),
+        )
+        url = reverse("shopping_cart")
+
+        # a job left running by a stopped worker is requeued and rendered
+        self.assertEqual(claim_shopping_list_job(), job)
+        ShoppingListJob.objects.filter(pk=job.pk).update(
+            started=timezone.now() - timedelta(minutes=5)
+        )
+        call_command("render_shopping_lists", "--once", stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, ShoppingListJob.Status.DONE)
+        self.assertEqual(job.attempts, 2)
+
+        # after the last attempt it fails and a new job is enqueued
+        ShoppingListJob.objects.filter(pk=job.pk).update(
+            status=ShoppingListJob.Status.RUNNING,
+            started=timezone.now() - timedelta(minutes=5),
+        )
+        self.assertEqual(requeue_stale_shopping_list_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ShoppingListJob.Status.FAILED)
+        response = self.usual_client.get(url, data={"async": "true"})
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertNotEqual(str(response.data["id"]), str(job.pk))
+
+    def test_add_favorite_and_shopping_cart_twice(self):
+        for url_name, model in (
+            ("favorite", Favorites),
+            ("shopping_cart", ShoppingCart),
+        ):
+            with self.subTest(url_name=url_name):
+                url = reverse(
+                    url_name,
+                    kwargs={"recipe_id": TestRecipeView.test_recipe.pk},
+                )
+                response = self.usual_client.post(url)
+                self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.usual_client.post(url)
+                self.assertEqual(
+                    response.status_code, status.HTTP_400_BAD_REQUEST
+                )
+                # the INSERT is not preceded by an existence check
+                table_queries = [
+                    query["sql"].upper()
+                    for query in queries
+                    if "recipes_" + model._meta.model_name in query["sql"]
+                ]
+                self.assertTrue(table_queries[0].startswith("INSERT"))
+
+                with self.assertRaises(IntegrityError):
+                    with transaction.atomic():
+                        model.objects.create(
+                            user=TestRecipeView.usual_user,
+                            recipe=TestRecipeView.test_recipe,
+                        )
+
+    def test_add_shopping_cart_receiver_error(self):
+        url = reverse(
+            "shopping_cart",
+            kwargs={"recipe_id": TestRecipeView.test_recipe.pk},
+        )
+        with patch(
+            "recipes.signals.refresh_cart_recipe",
+            side_effect=IntegrityError("totals"),
+        ):
+            with self.assertRaises(IntegrityError):
+                self.usual_client.post(url)
+        self.assertFalse(
+            ShoppingCart.objects.filter(
+                user=TestRecipeView.usual_user
+            ).exists()
+        )
+
+    def test_bulk_favorites_and_shopping_cart(self):
+        recipe = TestRecipeView.test_recipe
+        other_recipe = Recipe.objects.create(
+            author=TestRecipeView.author_user,
+            name="other recipe",
+            text="some_text",
+            image="recipes/other.png",
+            cooking_time=1,
+        )
+        Favorites.objects.create(user=TestRecipeView.usual_user, recipe=recipe)
+        missing_id = other_recipe.pk + 100
+
+        for url_name, model in (
+            ("favorite_bulk", Favorites),
+            ("shopping_cart_bulk", ShoppingCart),
+        ):
+            with self.subTest(url_name=url_name):
+                url = reverse(url_name)
+                data = {"recipes": [recipe.pk, other_recipe.pk, missing_id]}
+                response = self.usual_client.post(url, data, format="json")
+                self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+                self.assertEqual(
+                    [item["status"] for item in response.data],
+                    [
+                        "exists" if model is Favorites else "added",
+                        "added",
+                        "not_found",
+                    ],
+                )
+                self.assertEqual(
+                    response.data[1],
+                    {
+                        "id": other_recipe.pk,
+                        "cooking_time": 1,
+                        "image": "recipes/other.png",
+                        "name": "other recipe",
+                        "status": "added",
+                    },
+                )
+                self.assertEqual(
+                    model.objects.filter(
+                        user=TestRecipeView.usual_user
+                    ).count(),
+                    2,
+                )
+
+                response = self.usual_client.post(url, data, format="json")
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+                response = self.usual_client.delete(
+                    url, {"recipes": [other_recipe.pk]}, format="json"
+                )
+                self.assertEqual(response.data[0]["status"], "removed")
+                response = self.usual_client.delete(
+                    url, {"recipes": [other_recipe.pk]}, format="json"
+                )
+                self.assertEqual(response.data[0]["status"], "absent")
+                self.assertEqual(
+                    list(
+                        model.objects.filter(
+                            user=TestRecipeView.usual_user
+                        ).values_list("recipe_id", flat=True)
+                    ),
+                    [recipe.pk],
+                )
+
+                response = self.usual_client.post(
+                    url, {"recipes": []}, format="json"
+                )
+                self.assertEqual(
+                    response.status_code, status.HTTP_400_BAD_REQUEST
+                )
+
+        self.assertEqual(
+            dict(
+                ShoppingListItem.objects.filter(
+                    user=TestRecipeView.usual_user
+                ).values_list("ingredient_id", "total")
+            ),
+            {
+                TestRecipeView.ingredients[0].pk: 0,
+                TestRecipeView.ingredients[1].pk: 1,
+            },
+        )
+
+    def test_bulk_favorites_concurrent_change(self):
+        recipe = TestRecipeView.test_recipe
+        get_recipes = FavoritesBulkView.get_recipes
+
+        def get_recipes_and_race(view, request):
+            # another request favorites the recipe after the rows are read
+            result = get_recipes(view, request)
+            Favorites.objects.create(user=request.user, recipe=recipe)
+            return result
+
+        with patch.object(
+            FavoritesBulkView, "get_recipes", get_recipes_and_race
+        ):
+            self.usual_client.post(
+                reverse("favorite_bulk"),
+                {"recipes": [recipe.pk]},
+                format="json",
+            )
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 1)
+
+    def test_counters(self):
+        recipe = TestRecipeView.test_recipe
+        author = TestRecipeView.author_user
+
+        def counters():
+            recipe.refresh_from_db()
+            author.refresh_from_db()
+            return (
+                recipe.favorites_count,
+                author.recipes_count,
+                author.subscribers_count,
+            )
+
+        self.assertEqual(counters(), (0, 1, 0))
+        self.usual_client.post(
+            reverse("favorite", kwargs={"recipe_id": recipe.pk})
+        )
+        self.usual_client.post(
+            reverse("subscribe", kwargs={"user_id": author.pk})
+        )
+        Recipe.objects.create(
+            author=author,
+            name="other recipe",
+            text="some_text",
+            image="recipes/other.png",
+            cooking_time=1,
+        )
+        self.assertEqual(counters(), (1, 2, 1))
+
+        response = self.usual_client.get(
+            reverse("recipe-detail", kwargs={"pk": recipe.pk})
+        )
+        self.assertEqual(response.data["favorites_count"], 1)
+        self.assertEqual(response.data["author"]["recipes_count"], 2)
+        self.assertEqual(response.data["author"]["subscribers_count"], 1)
+
+        self.usual_client.delete(
+            reverse("favorite_bulk"), {"recipes": [recipe.pk]}, format="json"
+        )
+        Subscribe.objects.filter(subscribe=author).delete()
+        self.assertEqual(counters(), (0, 2, 0))
+
+        # full saves of stale instances keep the counters
+        stale_recipe = Recipe.objects.get(pk=recipe.pk)
+        stale_author = User.objects.get(pk=author.pk)
+        Favorites.objects.create(user=TestRecipeView.usual_user, recipe=recipe)
+        Subscribe.objects.create(
+            user=TestRecipeView.usual_user, subscribe=author
+        )
+        stale_recipe.save()
+        stale_author.save()
+        self.assertEqual(counters(), (1, 2, 1))
+        Favorites.objects.all().delete()
+        Subscribe.objects.all().delete()
+
+        Recipe.objects.filter(pk=recipe.pk).update(favorites_count=5)
+        User.objects.filter(pk=author.pk).update(
+            recipes_count=0, subscribers_count=3
+        )
+        call_command("repair_counters", "--batch-size", "1", stdout=StringIO())
+        self.assertEqual(counters(), (0, 2, 0))
+
+    def test_create_recipe_validation_queries(self):
+        ingredients = list(TestRecipeView.ingredients) + [
+            Ingredient.objects.create(
+                name=f"ingr_{number}", measurement_unit="g"
+            )
+            for number in range(3, 31)
+        ]
+        request = APIRequestFactory().post("/")
+        request.user = TestRecipeView.author_user
+
+        def get_serializer(ingredient_ids, tag_ids):
+            return CreateRecipeSerializer(
+                data={
+                    "name": "new recipe",
+                    "text": "some_text",
+                    "cooking_time": 2,
+                    "image": get_byte_64_image(),
+                    "tags": tag_ids,
+                    "ingredients": [
+                        {"id": pk, "amount": 1} for pk in ingredient_ids
+                    ],
+                },
+                context={"request": request},
+            )
+
+        tag_ids = [tag.pk for tag in TestRecipeView.tags]
+        for number in (1, 30):
+            with self.subTest(ingredients=number):
+                serializer = get_serializer(
+                    [ingredient.pk for ingredient in ingredients[:number]],
+                    tag_ids,
+                )
+                # one in_bulk() for tags and one for ingredients
+                with self.assertNumQueries(2):
+                    self.assertTrue(serializer.is_valid())
+                self.assertEqual(
+                    serializer.validated_data["ingredients"][-1]["id"],
+                    ingredients[number - 1],
+                )
+                self.assertEqual(
+                    serializer.validated_data["tags"], TestRecipeView.tags
+                )
+
+        missing_pk = ingredients[-1].pk + 1
+        serializer = get_serializer(
+            [ingredients[0].pk, missing_pk], tag_ids + [999]
+        )
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(
+            serializer.errors["tags"],
+            ['Invalid pk "999" - object does not exist.'],
+        )
+        self.assertEqual(
+            serializer.errors["ingredients"],
+            [
+                {},
+                {
+                    "id": [
+                        f'Invalid pk "{missing_pk}" - object does not exist.'
+                    ]
+                },
+            ],
+        )
+
+        serializer = get_serializer(["abc"], ["abc"])
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(
+            serializer.errors["tags"],
+            ["Incorrect type. Expected pk value, received str."],
+        )
+
+    def test_recipe_image_renditions(self):
+        image = Image.new("RGB", (3000, 1500), "red")
+        exif = Image.Exif()
+        exif[0x010F] = "Camera maker"
+        buffer = BytesIO()
+        image.save(buffer, "JPEG", exif=exif)
+        response = self.author_client.post(
+            reverse("recipe-list"),
+            data={
+                "name": "photo recipe",
+                "text": "some_text",
+                "cooking_time": 2,
+                "image": b64encode(buffer.getvalue()).decode(),
+                "tags": [TestRecipeView.tags[0].pk],
+                "ingredients": [
+                    {"id": TestRecipeView.ingredients[0].pk, "amount": 1}
+                ],
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        recipe = Recipe.objects.get(name="photo recipe")
+        storage = recipe.image.storage
+
+        with Image.open(storage.open(recipe.image.name)) as source:
+            self.assertEqual(source.size, (2048, 1024))
+            self.assertFalse(source.getexif())
+
+        renditions = recipe.image_renditions
+        self.assertEqual(renditions["source"], recipe.image.name)
+        for rendition, size in Setup.RECIPE_IMAGE_RENDITIONS:
+            for extension, image_format in RENDITION_FORMATS:
+                with Image.open(
+                    storage.open(renditions[rendition][extension])
+                ) as rendered:
+                    self.assertEqual(rendered.size, size)
+                    self.assertEqual(rendered.format, image_format)
+
+        response = self.author_client.get(
+            reverse("recipe-detail", kwargs={"pk": recipe.pk})
+        )
+        self.assertTrue(
+            response.data["image_renditions"]["card"]["webp"].startswith(
+                "http://testserver/media/recipes/renditions/"
+            )
+        )
+
+        # processing is skipped until the image changes
+        self.assertFalse(process_recipe_image(recipe))
+        call_command("process_recipe_images", stdout=StringIO())
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_renditions, renditions)
+
+    @override_settings(RECIPE_IMAGE_GRACE_PERIOD=0)
+    def test_recipe_image_saved_again(self):
+        def get_files():
+            return {
+                os.path.join(root, name)
+                for root, _, names in os.walk(storage.location)
+                for name in names
+            }
+
+        # noise changes with every lossy encoding
+        size = (2400, 1200)
+        buffer = BytesIO()
+        Image.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3)).save(
+            buffer, "JPEG"
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.author_client.post(
+                reverse("recipe-list"),
+                data=self.get_recipe_form_data(
+                    image=b64encode(buffer.getvalue()).decode()
+                ),
+                format="json",
+            )
+        recipe = Recipe.objects.get(pk=response.data["id"])
+        storage = recipe.image.storage
+        name, renditions = recipe.image.name, recipe.image_renditions
+        files = get_files()
+
+        # the served source is kept as it is, not encoded once more
+        with storage.open(name) as source:
+            image = b64encode(source.read()).decode()
+        for _ in range(2):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.author_client.patch(
+                    reverse("recipe-detail", kwargs={"pk": recipe.pk}),
+                    data=self.get_recipe_form_data(image=image),
+                    format="json",
+                )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            recipe.refresh_from_db()
+            self.assertEqual(recipe.image.name, name)
+            self.assertEqual(recipe.image_renditions, renditions)
+            self.assertEqual(get_files(), files)
+
+    def get_recipe_form_data(self, **fields):
+        data = {
+            "name": "form recipe",
+            "text": "some_text",
+            "cooking_time": 2,
+            "tags": [TestRecipeView.tags[0].pk],
+            "ingredients": [
+                {"id": TestRecipeView.ingredients[0].pk, "amount": 1}
+            ],
+        }
+        data.update(fields)
+        return data
+
+    def test_recipe_multipart_upload(self):
+        response = self.author_client.post(
+            reverse("recipe-list"),
+            data={
+                "data": json.dumps(self.get_recipe_form_data()),
+                "image": create_image(),
+            },
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        recipe = Recipe.objects.get(pk=response.data["id"])
+        self.assertTrue(recipe.image.storage.exists(recipe.image.name))
+        self.assertEqual(
+            list(recipe.tag.values_list("pk", flat=True)),
+            [TestRecipeView.tags[0].pk],
+        )
+
+        buffer = BytesIO()
+        Image.new("RGB", (20, 10), "yellow").save(buffer, "PNG")
+        response = self.author_client.patch(
+            reverse("recipe-detail", kwargs={"pk": recipe.pk}),
+            data={
+                "data": json.dumps(self.get_recipe_form_data(name="new")),
+                "image": SimpleUploadedFile("photo.png", buffer.getvalue()),
+            },
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        updated = Recipe.objects.get(pk=recipe.pk)
+        self.assertEqual(updated.name, "new")
+        self.assertNotEqual(updated.image.name, recipe.image.name)
+
+        response = self.author_client.post(
+            reverse("recipe-list"),
+            data={"data": "[]", "image": create_image()},
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_recipe_upload_limits(self):
+        buffer = BytesIO()
+        Image.new("RGB", (200, 10), "yellow").save(buffer, "PNG")
+        image = buffer.getvalue()
+
+        with override_settings(RECIPE_IMAGE_MAX_UPLOAD_SIZE=len(image) - 1):
+            response = self.author_client.post(
+                reverse("recipe-list"),
+                data={
+                    "data": json.dumps(self.get_recipe_form_data()),
+                    "image": SimpleUploadedFile("photo.png", image),
+                },
+                format="multipart",
+            )
+            self.assertEqual(
+                response.status_code,
+                status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+
+            response = self.author_client.post(
+                reverse("recipe-list"),
+                data=self.get_recipe_form_data(
+                    image=b64encode(image).decode()
+                ),
+                format="json",
+            )
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST
+            )
+            self.assertIn("image", response.data)
+
+            with override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=100):
+                response = self.author_client.post(
+                    reverse("recipe-list"),
+                    data=self.get_recipe_form_data(
+                        image=b64encode(image).decode()
+                    ),
+                    format="json",
+                )
+            self.assertEqual(
+                response.status_code,
+                status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+
+        with override_settings(RECIPE_IMAGE_MAX_UPLOAD_SIDE=199):
+            response = self.author_client.post(
+                reverse("recipe-list"),
+                data={
+                    "data": json.dumps(self.get_recipe_form_data()),
+                    "image": SimpleUploadedFile("photo.png", image),
+                },
+                format="multipart",
+            )
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST
+            )
+
+        buffer = BytesIO()
+        Image.new("RGB", (20, 10), "yellow").save(buffer, "BMP")
+        with self.assertRaises(ValidationError):
+            RecipeImageField().run_validation(
+                SimpleUploadedFile("photo.bmp", buffer.getvalue())
+            )
+        response = self.author_client.post(
+            reverse("recipe-list"),
+            data={
+                "data": json.dumps(self.get_recipe_form_data()),
+                "image": SimpleUploadedFile("photo.bmp", buffer.getvalue()),
+            },
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            response.data["image"], [RecipeImageField.INVALID_TYPE_MESSAGE]
+        )
+        self.assertFalse(Recipe.objects.filter(name="form recipe").exists())
+
+    def test_recipe_upload_peak_memory(self):
+        side = 1500
+        photo = Image.frombytes(
+            "RGB", (side, side), os.urandom(side * side * 3)
+        )
+        buffer = BytesIO()
+        photo.save(buffer, "JPEG", quality=100, subsampling=0)
+        image = buffer.getvalue()
+
+        view = RecipeViewSet.as_view({"post": "create"})
+        factory = APIRequestFactory()
+        requests = {
+            "json": factory.post(
+                reverse("recipe-list"),
+                data=self.get_recipe_form_data(
+                    image=b64encode(image).decode()
+                ),
+                format="json",
+            ),
+            "multipart": factory.post(
+                reverse("recipe-list"),
+                data={
+                    "data": json.dumps(self.get_recipe_form_data()),
+                    "image": SimpleUploadedFile("photo.jpg", image),
+                },
+                format="multipart",
+            ),
+        }
+        peaks = {}
+        for path, request in requests.items():
+            force_authenticate(request, TestRecipeView.author_user)
+            tracemalloc.start()
+            try:
+                response = view(request)
+                peaks[path] = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+                request.close()
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # the JSON body, the base64 string and the decoded image are all
+        # held at once, the streamed upload is never loaded
+        self.assertGreater(peaks["json"], 3 * len(image))
+        self.assertLess(peaks["multipart"], len(image))
+
+    @override_settings(RECIPE_JOBS_ASYNC=True, RECIPE_IMAGE_GRACE_PERIOD=0)
+    def test_recipe_jobs_run_by_worker(self):
+        buffer = BytesIO()
+        Image.new("RGB", (30, 20), "purple").save(buffer, "PNG")
+        response = self.author_client.post(
+            reverse("recipe-list"),
+            data=self.get_recipe_form_data(
+                image=b64encode(buffer.getvalue()).decode()
+            ),
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        recipe = Recipe.objects.get(pk=response.data["id"])
+        self.assertEqual(recipe.image_renditions, {})
+
+        # saving again while the job is pending queues nothing new
+        self.author_client.patch(
+            reverse("recipe-detail", kwargs={"pk": recipe.pk}),
+            data=self.get_recipe_form_data(name="renamed"),
+            format="json",
+        )
+        job = RecipeJob.objects.get(recipe=recipe)
+        self.assertEqual(job.status, RecipeJob.Status.PENDING)
+
+        call_command("run_recipe_jobs", "--once", stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, RecipeJob.Status.DONE)
+        self.assertEqual(job.attempts, 1)
+        recipe.refresh_from_db()
+        renditions = recipe.image_renditions
+        self.assertEqual(renditions["source"], recipe.image.name)
+        self.assertIsNone(run_recipe_job())
+
+        # a job repeated after it was done changes nothing
+        repeated = RecipeJob.objects.create(
+            recipe=recipe, task=RecipeJob.Task.PROCESS_IMAGE
+        )
+        self.assertEqual(run_recipe_job(), repeated)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_renditions, renditions)
+        storage = recipe.image.storage
+        self.assertTrue(
+            all(
+                storage.exists(name)
+                for name in iter_rendition_names(renditions)
+            )
+        )
+
+        # a new image clears the renditions of the replaced one in the
+        # same save, their files are released after the commit
+        buffer = BytesIO()
+        Image.new("RGB", (30, 20), "orange").save(buffer, "PNG")
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.author_client.patch(
+                reverse("recipe-detail", kwargs={"pk": recipe.pk}),
+                data=self.get_recipe_form_data(
+                    image=b64encode(buffer.getvalue()).decode()
+                ),
+                format="json",
+            )
+        self.assertEqual(response.data["image_renditions"], {})
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_renditions, {})
+        self.assertFalse(
+            any(
+                storage.exists(name)
+                for name in iter_rendition_names(renditions)
+            )
+        )
+
+    @override_settings(RECIPE_JOBS_ASYNC=True, RECIPE_IMAGE_GRACE_PERIOD=0)
+    def test_recipe_job_changes_cached_list(self):
+        buffer = BytesIO()
+        Image.new("RGB", (30, 20), "navy").save(buffer, "PNG")
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.author_client.post(
+                reverse("recipe-list"),
+                data=self.get_recipe_form_data(
+                    image=b64encode(buffer.getvalue()).decode()
+                ),
+                format="json",
+            )
+        recipe = Recipe.objects.get(pk=response.data["id"])
+        uploaded = recipe.image.name
+        url = reverse("recipe-list")
+        etag = self.client.get(url, {"limit": 10})["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("run_recipe_jobs", "--once", stdout=StringIO())
+        response = self.client.get(
+            url, {"limit": 10}, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+        data = next(
+            item
+            for item in response.data["results"]
+            if item["id"] == recipe.pk
+        )
+        self.assertNotEqual(data["image_renditions"], {})
+        self.assertFalse(recipe.image.storage.exists(uploaded))
+
+    @override_settings(RECIPE_JOB_MAX_ATTEMPTS=2, RECIPE_JOB_TIMEOUT=60)
+    def test_recipe_job_retries(self):
+        def fail(recipe):
+            raise OSError("storage is not available")
+
+        job = RecipeJob.objects.create(
+            recipe=TestRecipeView.test_recipe,
+            task=RecipeJob.Task.PROCESS_IMAGE,
+        )
+        with patch.dict(TASKS, {RecipeJob.Task.PROCESS_IMAGE: fail}):
+            self.assertEqual(run_recipe_job(), job)
+            job.refresh_from_db()
+            self.assertEqual(job.status, RecipeJob.Status.PENDING)
+            self.assertEqual(job.attempts, 1)
+            self.assertIn("storage is not available", job.error)
+            self.assertGreater(job.run_after, timezone.now())
+            self.assertIsNone(run_recipe_job())
+
+            RecipeJob.objects.filter(pk=job.pk).update(
+                run_after=timezone.now()
+            )
+            run_recipe_job()
+            job.refresh_from_db()
+            self.assertEqual(job.status, RecipeJob.Status.FAILED)
+            self.assertEqual(job.attempts, 2)
+
+        # a job left running by a stopped worker goes back to the queue
+        RecipeJob.objects.filter(pk=job.pk).update(
+            status=RecipeJob.Status.RUNNING,
+            attempts=1,
+            started=timezone.now() - timedelta(minutes=5),
+        )
+        self.assertEqual(requeue_stale_recipe_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, RecipeJob.Status.PENDING)
+        self.assertEqual(run_recipe_job(), job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, RecipeJob.Status.DONE)
+
+    def test_recipe_images_are_shared(self):
+        buffer = BytesIO()
+        Image.new("RGB", (40, 30), "green").save(buffer, "PNG")
+        image = b64encode(buffer.getvalue()).decode()
+        pks = []
+        for name in ("first copy", "second copy"):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.author_client.post(
+                    reverse("recipe-list"),
+                    data={
+                        "name": name,
+                        "text": "some_text",
+                        "cooking_time": 2,
+                        "image": image,
+                        "tags": [TestRecipeView.tags[0].pk],
+                        "ingredients": [
+                            {"id": TestRecipeView.ingredients[0].pk,
+                             "amount": 1}
+                        ],
+                    },
+                    format="json",
+                )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            pks.append(response.data["id"])
+
+        first, second = Recipe.objects.filter(pk__in=pks).order_by("pk")
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(first.image_renditions, second.image_renditions)
+        storage = first.image.storage
+        names = [first.image.name, *iter_rendition_names(
+            first.image_renditions)]
+
+        with self.settings(RECIPE_IMAGE_GRACE_PERIOD=0):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.author_client.delete(
+                    reverse("recipe-detail", kwargs={"pk": first.pk})
+                )
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertTrue(all(storage.exists(name) for name in names))
+
+        # just saved files are kept for an upload of the same image which
+        # may not be committed yet, and deleted by the cleanup later
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author_client.delete(
+                reverse("recipe-detail", kwargs={"pk": second.pk})
+            )
+        self.assertTrue(all(storage.exists(name) for name in names))
+
+        call_command(
+            "cleanup_recipe_images", "--grace", "0", stdout=StringIO()
+        )
+        self.assertFalse(any(storage.exists(name) for name in names))
+
+    def test_cleanup_recipe_images(self):
+        storage = Recipe._meta.get_field("image").storage
+        orphan = storage.save("recipes/orphan.png", create_image())
+        buffer = BytesIO()
+        Image.new("RGB", (4, 4), "blue").save(buffer, "PNG")
+        used = storage.save("recipes/used.png", ContentFile(buffer.getvalue()))
+        Recipe.objects.filter(pk=TestRecipeView.test_recipe.pk).update(
+            image=used
+        )
+
+        call_command("cleanup_recipe_images", stdout=StringIO())
+        self.assertTrue(storage.exists(orphan))
+
+        call_command(
+            "cleanup_recipe_images", "--grace", "0", stdout=StringIO()
+        )
+        self.assertFalse(storage.exists(orphan))
+        self.assertTrue(storage.exists(used))
+
+    def test_update_recipe_ingredients_diff(self):
+        recipe = TestRecipeView.test_recipe
+        ingredients = TestRecipeView.ingredients
+        RecipeIngredient.objects.filter(
+            recipe=recipe, ingredient=ingredients[0]
+        ).update(amount=1)
+        RecipeIngredient.objects.filter(
+            recipe=recipe, ingredient=ingredients[1]
+        ).update(amount=2)
+        request = APIRequestFactory().patch("/")
+        request.user = TestRecipeView.author_user
+
+        def get_serializer(amounts):
+            serializer = CreateRecipeSerializer(
+                recipe,
+                data={
+                    "name": "test recipe",
+                    "text": "fixed text",
+                    "cooking_time": 2,
+                    "tags": [tag.pk for tag in TestRecipeView.tags],
+                    "ingredients": [
+                        {"id": ingredient.pk, "amount": amount}
+                        for ingredient, amount in zip(ingredients, amounts)
+                    ],
+                },
+                context={"request": request},
+            )
+            serializer.is_valid(raise_exception=True)
+            return serializer
+
+        def get_rows():
+            return list(
+                RecipeIngredient.objects.filter(recipe=recipe)
+                .order_by("pk")
+                .values_list("pk", "ingredient_id", "amount")
+            )
+
+        rows = get_rows()
+        serializer = get_serializer((1, 2))
+        # savepoint, ingredients, tags, recipe UPDATE, savepoint release
+        with self.assertNumQueries(5):
+            serializer.save()
+        self.assertEqual(get_rows(), rows)
+
+        serializer = get_serializer((1, 5))
+        # and one bulk UPDATE of the amount and the lookup of the carts
+        # whose shopping lists are refreshed
+        with self.assertNumQueries(7):
+            serializer.save()
+        self.assertEqual(
+            get_rows(), [rows[0], (rows[1][0], ingredients[1].pk, 5)]
+        )
+
+        serializer = get_serializer((3,))
+        with self.captureOnCommitCallbacks(execute=True):
+            serializer.save()
+        self.assertEqual(
+            get_rows(), [(rows[0][0], ingredients[0].pk, 3)]
+        )
+
+    def test_shopping_list_totals(self):
+        user = TestRecipeView.usual_user
+        ingredients = TestRecipeView.ingredients
+
+        def totals():
+            return dict(
+                ShoppingListItem.objects.filter(user=user).values_list(
+                    "ingredient_id", "total"
+                )
+            )
+
+        other_recipe = Recipe.objects.create(
+            author=TestRecipeView.author_user,
+            name="other recipe",
+            text="some_text",
+            image="recipes/other.png",
+            cooking_time=1,
+        )
+        RecipeIngredient.objects.create(
+            recipe=other_recipe, ingredient=ingredients[1], amount=5
+        )
+
+        for recipe in (TestRecipeView.test_recipe, other_recipe):
+            self.usual_client.post(
+                reverse("shopping_cart", kwargs={"recipe_id": recipe.pk})
+            )
+        self.assertEqual(
+            totals(), {ingredients[0].pk: 0, ingredients[1].pk: 6}
+        )
+
+        recipe_ingredient = RecipeIngredient.objects.get(
+            recipe=other_recipe
+        )
+        recipe_ingredient.ingredient = ingredients[0]
+        recipe_ingredient.save()
+        self.assertEqual(
+            totals(), {ingredients[0].pk: 5, ingredients[1].pk: 1}
+        )
+
+        self.author_client.patch(
+            reverse("recipe-detail", kwargs={"pk": other_recipe.pk}),
+            data=json.dumps(
+                {
+                    "name": "other recipe",
+                    "text": "some_text",
+                    "cooking_time": 1,
+                    "tags": [TestRecipeView.tags[0].pk],
+                    "ingredients": [
+                        {"id": ingredients[1].pk, "amount": 3},
+                    ],
+                }
+            ),
+            content_type="application/json",
+        )
+        self.assertEqual(
+            totals(), {ingredients[0].pk: 0, ingredients[1].pk: 4}
+        )
+
+        self.usual_client.delete(
+            reverse(
+                "shopping_cart",
+                kwargs={"recipe_id": TestRecipeView.test_recipe.pk},
+            )
+        )
+        self.assertEqual(
+            totals(), {ingredients[1].pk: 3}
+        )
+
+        other_recipe.delete()
+        self.assertEqual(totals(), {})
+
+    def test_shopping_lists_command(self):
+        ShoppingCart.objects.create(
+            user=TestRecipeView.usual_user, recipe=TestRecipeView.test_recipe
+        )
+        call_command("shopping_lists", "--verify", stdout=StringIO())
+
+        ShoppingListItem.objects.filter(
+            user=TestRecipeView.usual_user
+        ).update(total=100)
+        with self.assertRaises(CommandError):
+            call_command("shopping_lists", "--verify", stdout=StringIO())
+
+        call_command("shopping_lists", stdout=StringIO())
+        call_command("shopping_lists", "--verify", stdout=StringIO())
+        self.assertEqual(
+            ShoppingListItem.objects.get(
+                user=TestRecipeView.usual_user,
+                ingredient=TestRecipeView.ingredients[1],
+            ).total,
+            1,
+        )
+
+    def test_recipes_list_cursor_pagination(self):
+        for number in range(6):
+            recipe = Recipe.objects.create(
+                author=TestRecipeView.usual_user,
+                name=f"recipe_{number}",
+                text="some_text",
+                image=f"recipes/recipe_{number}.png",
+                cooking_time=1,
+            )
+            recipe.tag.set(TestRecipeView.tags[number % 2:])
+        # recipes published in the same moment are ordered by id
+        Recipe.objects.filter(author=TestRecipeView.usual_user).update(
+            pub_date=TestRecipeView.test_recipe.pub_date
+        )
+
+        for filters in (
+            {},
+            {"tags": "tag_2"},
+            {"author": TestRecipeView.usual_user.pk},
+        ):
+            with self.subTest(filters=filters):
+                expected_ids = [
+                    recipe["id"]
+                    for recipe in self.usual_client.get(
+                        reverse("recipe-list"), data={"limit": 100, **filters}
+                    ).data["results"]
+                ]
+                ids = []
+                url = reverse("recipe-list")
+                data = {"cursor": "", "limit": 3, **filters}
+                while url:
+                    response = self.usual_client.get(url, data=data)
+                    self.assertNotIn("count", response.data)
+                    ids.extend(
+                        recipe["id"] for recipe in response.data["results"]
+                    )
+                    url, data = response.data["next"], None
+                self.assertEqual(ids, expected_ids)
+
+                last_page_start = len(ids) - len(response.data["results"])
+                previous = self.usual_client.get(response.data["previous"])
+                self.assertEqual(
+                    [recipe["id"] for recipe in previous.data["results"]],
+                    ids[last_page_start - 3:last_page_start],
+                )
+
+        response = self.usual_client.get(
+            reverse("recipe-list"), data={"cursor": "invalid"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_recipe_detail(self):
         response = self.usual_client.get(
             reverse(
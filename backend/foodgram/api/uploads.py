@@ -0,0 +1,104 @@
+import json
+
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.utils.datastructures import MultiValueDict
+from rest_framework import status
+from rest_framework.exceptions import APIException, ParseError
+from rest_framework.parsers import (DataAndFiles, JSONParser,
+                                    MultiPartParser)
+
+
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Uploaded file is too large.'
+    default_code = 'upload_too_large'
+
+
+class LimitedTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    """Stream uploaded files to temporary files, chunk by chunk.
+
+    The upload is aborted with UploadTooLarge as soon as a file exceeds
+    ``max_size`` bytes, settings.RECIPE_IMAGE_MAX_UPLOAD_SIZE by default.
+    """
+
+    def __init__(self, request=None, max_size=None):
+        super().__init__(request)
+        if max_size is None:
+            max_size = settings.RECIPE_IMAGE_MAX_UPLOAD_SIZE
+        self.max_size = max_size
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > self.max_size:
+            self.file.close()
+            raise UploadTooLarge(
+                f'Uploaded files may not be larger than '
+                f'{self.max_size} bytes.')
+        return super().receive_data_chunk(raw_data, start)
+
+
+class LimitedJSONParser(JSONParser):
+    """JSON parser refusing bodies too large for an image within
+    settings.RECIPE_IMAGE_MAX_UPLOAD_SIZE before reading them.
+
+    The base64 encoded image is allowed a third more bytes than the
+    limit, the other fields settings.DATA_UPLOAD_MAX_MEMORY_SIZE.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = (parser_context or {}).get('request')
+        if request is not None:
+            max_size = settings.RECIPE_IMAGE_MAX_UPLOAD_SIZE
+            limit = (-(-max_size // 3) * 4
+                     + (settings.DATA_UPLOAD_MAX_MEMORY_SIZE or 0))
+            try:
+                content_length = int(request.META.get('CONTENT_LENGTH', 0))
+            except (TypeError, ValueError):
+                content_length = 0
+            if content_length > limit:
+                raise UploadTooLarge(
+                    f'Request bodies may not be larger than {limit} bytes.')
+        return super().parse(stream, media_type, parser_context)
+
+
+class JSONPartData(dict):
+    """Fields of a multipart request read from its JSON part.
+
+    Request merges the uploaded files into a copy of the data, a plain
+    dict would take the lists of a MultiValueDict instead of the files.
+    """
+
+    def copy(self):
+        return type(self)(self)
+
+    def update(self, other=(), **kwargs):
+        if isinstance(other, MultiValueDict):
+            other = other.dict()
+        super().update(other, **kwargs)
+
+
+class MultiPartJSONParser(MultiPartParser):
+    """Multipart parser taking the fields from a JSON document.
+
+    Nested fields such as recipe ingredients can not be sent as form
+    fields, so clients send the JSON body in the ``data`` part and the
+    files in parts of their own. Requests without the ``data`` part are
+    parsed as plain forms.
+    """
+
+    data_field = 'data'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parsed = super().parse(stream, media_type, parser_context)
+        if self.data_field not in parsed.data:
+            return parsed
+
+        try:
+            data = json.loads(parsed.data[self.data_field])
+        except ValueError as exc:
+            raise ParseError(
+                f'JSON parse error in the {self.data_field} part - {exc}')
+        if not isinstance(data, dict):
+            raise ParseError(
+                f'The {self.data_field} part must be a JSON object.')
+        return DataAndFiles(JSONPartData(data), parsed.files)
@@ -1,11 +1,20 @@
 from datetime import datetime
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
-from django.shortcuts import get_object_or_404
+from django.core.cache import cache
+from django.db import transaction
+from django.http import Http404, HttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
-from rest_framework.generics import CreateAPIView, DestroyAPIView, ListAPIView
+from rest_framework import status
+from rest_framework.generics import (
+    CreateAPIView,
+    DestroyAPIView,
+    ListAPIView,
+    get_object_or_404,
+)
 from rest_framework.permissions import SAFE_METHODS, IsAuthenticated, AllowAny
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
@@ -15,7 +24,9 @@ from api.serializers import (
     FavoritesSerializer,
     GetRecipeSerializer,
     IngredientSerializer,
+    RecipeIdsSerializer,
     ShoppingCartSerializer,
+    ShoppingListJobSerializer,
     SubscribeSerializer,
     TagSerializer,
 )
@@ -25,14 +36,37 @@ from recipes.models import (
     Recipe,
     RecipeIngredient,
     ShoppingCart,
+    ShoppingListJob,
     Tag,
 )
+from recipes.counters import repair_recipe_counters
+from recipes.queries import delete_rows
+from recipes.registry import ingredient_index, tag_registry
+from recipes.shopping_lists import refresh_totals
+from recipes.versions import (
+    bump_catalog_version,
+    bump_user_version,
+    get_ingredient_version,
+    get_tag_version,
+)
 from users.models import Subscribe
 from djoser.conf import settings as djoser_settings
+from .cache import (
+    cache_anonymous_response,
+    conditional_response,
+    get_shopping_cart_hash,
+)
 from .filters import IngredientFilter, RecipeFilter
-from .paginators import PageLimitedPaginator
+from .jobs import enqueue_shopping_list
+from .paginators import PageLimitedPaginator, RecipeKeysetPaginator
 from .permissions import IsAuthorOrReadOnly
-from .renders import ShoppingListToPDFRenderer
+from .readers import RecipeReader
+from .renders import ShoppingListToPDFRenderer, render_shopping_list
+from .uploads import (
+    LimitedJSONParser,
+    LimitedTemporaryFileUploadHandler,
+    MultiPartJSONParser,
+)
 
 
 User = get_user_model()
@@ -59,6 +93,23 @@ class TagViewSet(ReadOnlyModelViewSet):
         "get",
     ]
 
+    def get_object(self):
+        try:
+            tag = tag_registry.get(self.kwargs[self.lookup_field])
+        except Tag.DoesNotExist:
+            raise Http404
+        self.check_object_permissions(self.request, tag)
+        return tag
+
+    @conditional_response(get_version=get_tag_version)
+    def list(self, request, *args, **kwargs):
+        serializer = self.get_serializer(tag_registry.all(), many=True)
+        return Response(serializer.data)
+
+    @conditional_response(get_version=get_tag_version)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
 
 class IngredientViewSet(ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
@@ -70,6 +121,22 @@ class IngredientViewSet(ReadOnlyModelViewSet):
         "get",
     ]
 
+    @conditional_response(get_version=get_ingredient_version)
+    def list(self, request, *args, **kwargs):
+        if not settings.INGREDIENT_SEARCH_IN_MEMORY or (
+            request.query_params.get("fuzzy")
+        ):
+            return super().list(request, *args, **kwargs)
+
+        name = request.query_params.get("name")
+        if name:
+            return Response(ingredient_index.search(name))
+        return Response(ingredient_index.all())
+
+    @conditional_response(get_version=get_ingredient_version)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
 
 class RecipeViewSet(ModelViewSet):
     queryset = Recipe.objects.prefetch_related(
@@ -80,6 +147,44 @@ class RecipeViewSet(ModelViewSet):
     permission_classes = (IsAuthorOrReadOnly,)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
+    user_filter_params = ("is_favorited", "is_in_shopping_cart")
+    parser_classes = (LimitedJSONParser, MultiPartJSONParser)
+
+    def initialize_request(self, request, *args, **kwargs):
+        # uploaded images go to temporary files, never to memory
+        request.upload_handlers = [LimitedTemporaryFileUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
+    @property
+    def paginator(self):
+        if not hasattr(self, "_paginator"):
+            if self.request.query_params.get("cursor") is not None:
+                self._paginator = RecipeKeysetPaginator()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def get_queryset(self):
+        return super().get_queryset().with_user_flags(self.request.user)
+
+    @conditional_response(per_user=True, counters=True)
+    @cache_anonymous_response
+    def list(self, request, *args, **kwargs):
+        reader = RecipeReader(request)
+        queryset = reader.get_values(self.filter_queryset(self.get_queryset()))
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(reader.represent(page))
+        return Response(reader.represent(queryset))
+
+    @conditional_response(per_user=True, counters=True)
+    @cache_anonymous_response
+    def retrieve(self, request, *args, **kwargs):
+        reader = RecipeReader(request)
+        queryset = reader.get_values(self.filter_queryset(self.get_queryset()))
+        recipe = get_object_or_404(queryset, pk=self.kwargs["pk"])
+        return Response(reader.represent([recipe])[0])
 
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
@@ -90,6 +195,10 @@ class RecipeViewSet(ModelViewSet):
     def get_serializer_context(self):
         return {"request": self.request}
 
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        bump_catalog_version()
+
 
 class FavoritesView(CreateAPIView, DestroyAPIView):
     serializer_class = FavoritesSerializer
@@ -136,14 +245,136 @@ class ShoppingCartView(CreateAPIView, DestroyAPIView):
         return serializer
 
 
+class BulkRecipeRelationView(APIView):
+    """Adds (POST) or removes (DELETE) many recipes of the current user's
+    favorites or shopping cart at once.
+
+    Takes {"recipes": [ids]} and returns a result for every id: the
+    representation of ``serializer_class`` with a status, or only the id
+    and status "not_found" for unknown recipes. Rows are written with one
+    bulk INSERT or DELETE, so the per-row signal receivers are replaced
+    by a single call of ``recipes_changed()`` with the number of rows
+    added to (1) or removed from (-1) every recipe.
+    """
+
+    permission_classes = (IsAuthenticated,)
+    model = None
+    serializer_class = None
+
+    def get_recipes(self, request):
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = list(dict.fromkeys(serializer.validated_data["recipes"]))
+        recipes = Recipe.objects.only(
+            "id", "name", "image", "cooking_time"
+        ).in_bulk(recipe_ids)
+        existing = set(
+            self.model.objects.filter(
+                user=request.user, recipe__in=recipes
+            ).values_list("recipe_id", flat=True)
+        )
+        return recipe_ids, recipes, existing
+
+    def recipes_changed(self, user, recipe_ids, delta):
+        bump_user_version(user.pk)
+
+    def get_results(self, request, recipe_ids, recipes, statuses):
+        results = []
+        for recipe_id in recipe_ids:
+            recipe = recipes.get(recipe_id)
+            if recipe is None:
+                results.append({"id": recipe_id, "status": "not_found"})
+                continue
+            data = self.serializer_class(
+                self.model(user=request.user, recipe=recipe)
+            ).data
+            data["status"] = statuses[recipe_id]
+            results.append(data)
+        return results
+
+    @transaction.atomic
+    def post(self, request, format=None):
+        recipe_ids, recipes, existing = self.get_recipes(request)
+        added = [pk for pk in recipes if pk not in existing]
+        self.model.objects.bulk_create(
+            (self.model(user=request.user, recipe_id=pk) for pk in added),
+            ignore_conflicts=True,
+        )
+        if added:
+            self.recipes_changed(request.user, added, 1)
+
+        statuses = {pk: "exists" for pk in existing}
+        statuses.update((pk, "added") for pk in added)
+        return Response(
+            self.get_results(request, recipe_ids, recipes, statuses),
+            status=status.HTTP_201_CREATED if added else status.HTTP_200_OK,
+        )
+
+    @transaction.atomic
+    def delete(self, request, format=None):
+        recipe_ids, recipes, existing = self.get_recipes(request)
+        if existing:
+            # nothing references these rows, recipes_changed() does the
+            # work of the signal receivers
+            delete_rows(
+                self.model.objects.filter(
+                    user=request.user, recipe__in=existing
+                )
+            )
+            self.recipes_changed(request.user, existing, -1)
+
+        statuses = {pk: "absent" for pk in recipes}
+        statuses.update((pk, "removed") for pk in existing)
+        return Response(
+            self.get_results(request, recipe_ids, recipes, statuses)
+        )
+
+
+class FavoritesBulkView(BulkRecipeRelationView):
+    model = Favorites
+    serializer_class = FavoritesSerializer
+
+    def recipes_changed(self, user, recipe_ids, delta):
+        super().recipes_changed(user, recipe_ids, delta)
+        # The statuses come from rows read before the writes, a concurrent
+        # request may have added or removed some of them meanwhile, so the
+        # counters are recounted instead of changed by ``delta``. The lock
+        # waits for the counter updates of concurrent writers, the recount
+        # then sees their rows.
+        list(
+            Recipe.objects.select_for_update()
+            .filter(pk__in=recipe_ids)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+        repair_recipe_counters(recipe_ids)
+
+
+class ShoppingCartBulkView(BulkRecipeRelationView):
+    model = ShoppingCart
+    serializer_class = ShoppingCartSerializer
+
+    def recipes_changed(self, user, recipe_ids, delta):
+        super().recipes_changed(user, recipe_ids, delta)
+        refresh_totals(
+            [user.pk],
+            RecipeIngredient.objects.filter(
+                recipe__in=recipe_ids
+            ).values_list("ingredient_id", flat=True),
+        )
+
+
 class SubscriptionsView(ListAPIView):
     pagination_class = PageLimitedPaginator
     serializer_class = SubscribeSerializer
     permission_classes = (IsAuthenticated,)
+    count_per_user = True
 
     def get_queryset(self):
-        return Subscribe.objects.prefetch_related("subscribe").filter(
-            user=self.request.user
+        return (
+            Subscribe.objects.select_related("subscribe")
+            .filter(user=self.request.user)
+            .order_by("id")
         )
 
     def get_serializer_context(self):
@@ -173,22 +404,87 @@ class SubscribeView(CreateAPIView, DestroyAPIView):
         return serializer
 
 
+def get_shopping_list_response(document: bytes) -> HttpResponse:
+    file_name = f'Shopping_list_{datetime.now().strftime("%d_%m_%Y")}.pdf'
+    response = HttpResponse(
+        document, content_type=ShoppingListToPDFRenderer.media_type
+    )
+    response["Content-Disposition"] = f'attachment; filename="{file_name}"'
+    return response
+
+
 class ShoppingCartRenderView(APIView):
-    renderer_classes = (ShoppingListToPDFRenderer,)
+    renderer_classes = (ShoppingListToPDFRenderer, JSONRenderer)
     permission_classes = [
         IsAuthenticated,
     ]
 
     # http_method_names = ['GET']
 
+    def is_async(self, request):
+        param = request.query_params.get("async")
+        if param is not None:
+            return param.lower() in ("1", "true")
+        return settings.SHOPPING_LIST_RENDER_ASYNC
+
+    def get_renderers(self):
+        # the job status is JSON whatever the client asked for
+        if self.is_async(self.request):
+            return [JSONRenderer()]
+        return super().get_renderers()
+
+    def perform_content_negotiation(self, request, force=False):
+        # the document is sent as it is, only the errors are negotiated
+        return super().perform_content_negotiation(request, force=True)
+
     def get(self, request, format=None):
-        shopping_cart = (
-            RecipeIngredient.objects.all()
-            .filter(recipe__shopping_carts__user=request.user)
-            .values("ingredient__name", "ingredient__measurement_unit")
-            .annotate(total=Sum("amount"))
+        content_hash = get_shopping_cart_hash(request.user)
+        if self.is_async(request):
+            job = enqueue_shopping_list(request.user, content_hash)
+            serializer = ShoppingListJobSerializer(
+                job, context={"request": request}
+            )
+            return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+        # The last document of every user is cached with the hash of the
+        # cart it was built from, a changed cart or ingredient of a carted
+        # recipe changes the hash.
+        cache_key = f"shopping-list:{request.user.pk}"
+        cached = cache.get(cache_key)
+        if cached is not None and cached[0] == content_hash:
+            document = cached[1]
+        else:
+            document = render_shopping_list(request.user)
+            cache.set(
+                cache_key,
+                (content_hash, document),
+                settings.SHOPPING_LIST_CACHE_TIMEOUT,
+            )
+        return get_shopping_list_response(document)
+
+
+class ShoppingListJobView(APIView):
+    permission_classes = (IsAuthenticated,)
+    renderer_classes = (JSONRenderer,)
+
+    def perform_content_negotiation(self, request, force=False):
+        # a client waiting for the document asks for application/pdf, the
+        # status of an unfinished job is still answered in JSON
+        return super().perform_content_negotiation(request, force=True)
+
+    def get(self, request, job_id, format=None):
+        job = get_object_or_404(
+            ShoppingListJob.objects.defer("document"),
+            pk=job_id,
+            user=request.user,
+        )
+        if job.status == ShoppingListJob.Status.DONE:
+            job.refresh_from_db(fields=("document",))
+            return get_shopping_list_response(bytes(job.document))
+
+        serializer = ShoppingListJobSerializer(
+            job, context={"request": request}
         )
-        file_name = f'Shopping_list_{datetime.now().strftime("%d_%m_%Y")}.pdf'
-        response = Response(shopping_cart)
-        response["Content-Disposition"] = f'attachment; filename="{file_name}"'
-        return response
+        if job.status == ShoppingListJob.Status.FAILED:
+            return Response(serializer.data)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
@@ -29,6 +29,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'django_filters',
     'rest_framework',
     'djoser',
@@ -150,6 +151,103 @@ REST_FRAMEWORK = {
     ),
 }
 
+# Cache
+# Catalog, user and recipe versions live in the cache, so every process
+# (gunicorn workers, job workers, management commands) must share it. The
+# compose files run memcached and set CACHE_BACKEND/CACHE_LOCATION; the
+# local memory default is only good for tests and a single dev server.
+# memcached runs with 8 MB items, so generated shopping lists fit.
+# An evicted version key is recreated with a new value, which only drops
+# cached responses.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', default=''),
+    }
+}
+
+# Responses of anonymous recipe list and detail requests are cached for
+# this number of seconds or until the recipe catalog version changes.
+
+RECIPES_RESPONSE_CACHE_TIMEOUT = 300
+
+# The last generated shopping list of every user is kept for this number of
+# seconds and served again while the cart contents stay the same.
+
+SHOPPING_LIST_CACHE_TIMEOUT = 60 * 60
+
+# With async rendering on, shopping list downloads only enqueue a job for
+# the render_shopping_lists worker and return its id. Clients may also ask
+# for it with ?async=true. Finished jobs are deleted after the TTL, jobs
+# running longer than the timeout are requeued until the attempts run out.
+
+SHOPPING_LIST_RENDER_ASYNC = os.getenv(
+    'SHOPPING_LIST_RENDER_ASYNC', default='False') == 'True'
+
+SHOPPING_LIST_JOB_TTL = 24 * 60 * 60
+
+SHOPPING_LIST_JOB_TIMEOUT = 5 * 60
+
+SHOPPING_LIST_JOB_MAX_ATTEMPTS = 3
+
+# Total counts of paginated responses are cached for this number of seconds.
+# With the threshold set, unfiltered lists of tables with at least that many
+# rows report the PostgreSQL planner estimate instead of an exact count.
+
+PAGINATION_COUNT_CACHE_TIMEOUT = 30
+
+PAGINATION_COUNT_ESTIMATE_THRESHOLD = os.getenv(
+    'PAGINATION_COUNT_ESTIMATE_THRESHOLD', default=None)
+
+if PAGINATION_COUNT_ESTIMATE_THRESHOLD is not None:
+    PAGINATION_COUNT_ESTIMATE_THRESHOLD = int(
+        PAGINATION_COUNT_ESTIMATE_THRESHOLD)
+
+
+# Ingredient autocomplete is served from the in-process index by default.
+# Disable it for catalogs too large to keep in every worker, the database
+# then uses the UPPER(name) and trigram indexes of recipes.Ingredient.
+
+INGREDIENT_SEARCH_IN_MEMORY = os.getenv(
+    'INGREDIENT_SEARCH_IN_MEMORY', default='True') == 'True'
+
+
+# Recipe photos are sent base64 encoded in JSON or as the image part of a
+# multipart/form-data request, which is streamed to a temporary file.
+# Larger files and images with a longer side are rejected.
+
+RECIPE_IMAGE_MAX_UPLOAD_SIZE = int(os.getenv(
+    'RECIPE_IMAGE_MAX_UPLOAD_SIZE', default=10 * 1024 * 1024))
+
+RECIPE_IMAGE_MAX_UPLOAD_SIDE = 8000
+
+# Image files saved or touched within the grace period are not deleted when
+# released, an upload of the same content may be about to refer to them.
+# The cleanup_recipe_images command deletes them later.
+
+RECIPE_IMAGE_GRACE_PERIOD = 60 * 60
+
+
+# With async recipe jobs on, work derived from a saved recipe such as image
+# processing is queued for the run_recipe_jobs worker instead of being done
+# by the request. Failed jobs are retried after a delay doubled with every
+# attempt, jobs running longer than the timeout are requeued. Done jobs are
+# deleted after the TTL.
+
+RECIPE_JOBS_ASYNC = os.getenv(
+    'RECIPE_JOBS_ASYNC', default='False') == 'True'
+
+RECIPE_JOB_MAX_ATTEMPTS = 5
+
+RECIPE_JOB_RETRY_DELAY = 30
+
+RECIPE_JOB_TIMEOUT = 10 * 60
+
+RECIPE_JOB_TTL = 24 * 60 * 60
+
 
 DJOSER = {
     'HIDE_USERS': False,
@@ -7,10 +7,13 @@ from api.views import (
     IngredientViewSet,
     RecipeViewSet,
     FavoritesView,
+    FavoritesBulkView,
     ShoppingCartView,
+    ShoppingCartBulkView,
     SubscribeView,
     SubscriptionsView,
     ShoppingCartRenderView,
+    ShoppingListJobView,
 )
 
 router_api = DefaultRouter()
@@ -27,6 +30,21 @@ urlpatterns = [
         ShoppingCartRenderView.as_view(),
         name="shopping_cart",
     ),
+    path(
+        r"api/recipes/download_shopping_cart/<uuid:job_id>/",
+        ShoppingListJobView.as_view(),
+        name="shopping_list_job",
+    ),
+    path(
+        r"api/recipes/favorite/",
+        FavoritesBulkView.as_view(),
+        name="favorite_bulk",
+    ),
+    path(
+        r"api/recipes/shopping_cart/",
+        ShoppingCartBulkView.as_view(),
+        name="shopping_cart_bulk",
+    ),
     path(
         r"api/users/subscriptions/",
         SubscriptionsView.as_view(),
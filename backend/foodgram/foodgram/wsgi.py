@@ -14,3 +14,16 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
 
 application = get_wsgi_application()
+
+# Warm per-process caches before gunicorn forks the workers (--preload)
+# or, without preloading, before the first request of each worker.
+from django.db import connections  # noqa: E402
+
+from api.renders import load_pdf_resources  # noqa: E402
+from recipes.registry import ingredient_index, tag_registry  # noqa: E402
+
+tag_registry.warm()
+ingredient_index.warm()
+load_pdf_resources()
+# Forked workers must not share the connections opened while warming.
+connections.close_all()
@@ -8,3 +8,12 @@ class Setup:
     COOKING_TIME_MIN_VALUE = 1
     INGREDIENT_AMOUNT_MIN_VALUE = 0
     RECIPES_IMAGE_FOLDER = 'recipes'
+    TAG_REGISTRY_TTL = 300
+    INGREDIENT_INDEX_TTL = 300
+    RECIPE_IMAGE_MAX_SIDE = 2048
+    RECIPE_IMAGE_RENDITIONS_FOLDER = 'recipes/renditions'
+    RECIPE_IMAGE_RENDITIONS = (
+        ('thumbnail', (160, 160)),
+        ('card', (480, 320)),
+        ('detail', (1200, 800)),
+    )
@@ -61,6 +61,6 @@ class RecipesAdmin(ModelAdmin):
     list_filter = ('author', 'name', 'tag')
 
     def in_favorites_count(self, recipe: Recipe):
-        return recipe.in_favorites.count()
+        return recipe.favorites_count
 
     in_favorites_count.short_description = 'Number of adds to favorites'
@@ -0,0 +1,43 @@
+from typing import Iterable
+
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, OuterRef, QuerySet, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from users.models import Subscribe
+
+from .models import Favorites, Recipe
+from .versions import bump_counter_versions
+
+User = get_user_model()
+
+
+def change_counter(queryset: QuerySet, field: str, delta: int):
+    """Add ``delta`` to a counter column in one UPDATE, never going
+    below zero."""
+    queryset.update(**{field: Greatest(F(field) + delta, 0)})
+
+
+def count_rows(queryset: QuerySet, field: str):
+    """Return the number of ``queryset`` rows referencing the outer row
+    by ``field`` as a subquery expression."""
+    return Coalesce(Subquery(
+        queryset.filter(**{field: OuterRef('pk')}).order_by().values(
+            field).annotate(count=Count('pk')).values('count')
+    ), 0)
+
+
+def repair_recipe_counters(recipe_ids: Iterable[int]):
+    recipe_ids = list(recipe_ids)
+    Recipe.objects.filter(pk__in=recipe_ids).update(
+        favorites_count=count_rows(Favorites.objects.all(), 'recipe'))
+    bump_counter_versions(recipe_ids=recipe_ids)
+
+
+def repair_user_counters(user_ids: Iterable[int]):
+    user_ids = list(user_ids)
+    User.objects.filter(pk__in=user_ids).update(
+        recipes_count=count_rows(Recipe.objects.all(), 'author'),
+        subscribers_count=count_rows(Subscribe.objects.all(), 'subscribe'),
+    )
+    bump_counter_versions(user_ids=user_ids)
@@ -0,0 +1,215 @@
+import io
+import os
+from datetime import timedelta
+from functools import partial
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.core.files.base import File
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from recipes import Setup
+
+from .models import Recipe
+from .versions import bump_catalog_version, bump_recipe_version
+
+# (extension, Pillow format) of every rendition
+RENDITION_FORMATS = (('webp', 'WEBP'), ('jpeg', 'JPEG'))
+
+SAVE_OPTIONS = {
+    'JPEG': {'quality': 85, 'optimize': True, 'progressive': True},
+    'WEBP': {'quality': 80, 'method': 4},
+    'PNG': {'optimize': True},
+}
+
+
+def encode(image: Image.Image, image_format: str) -> File:
+    """Encode the image without any metadata."""
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **SAVE_OPTIONS[image_format])
+    # saved from the buffer itself, without copying it to bytes
+    return File(buffer)
+
+
+# Image.info keys of metadata encode() does not write
+METADATA_KEYS = {'exif', 'icc_profile', 'xmp', 'XML:com.adobe.xmp', 'comment'}
+
+
+def open_image(file) -> Image.Image:
+    image = Image.open(file)
+    image.load()
+    return image
+
+
+def normalize_mode(image: Image.Image) -> Image.Image:
+    """Apply the EXIF orientation and convert to RGB, or to RGBA if the
+    image has transparency."""
+    image = ImageOps.exif_transpose(image)
+    has_alpha = (
+        image.mode in ('RGBA', 'LA')
+        or (image.mode == 'P' and 'transparency' in image.info)
+    )
+    return image.convert('RGBA' if has_alpha else 'RGB')
+
+
+def is_normalized(original: Image.Image, image: Image.Image,
+                  image_format: str) -> bool:
+    """Return True if the uploaded image is already stored the way it
+    would be re-encoded: in the source format and mode, within
+    Setup.RECIPE_IMAGE_MAX_SIDE and without metadata."""
+    return (
+        original.format == image_format
+        and original.mode == image.mode
+        and max(original.size) <= Setup.RECIPE_IMAGE_MAX_SIDE
+        and not original.getexif()
+        and not METADATA_KEYS & original.info.keys()
+    )
+
+
+def save_renditions(storage, image: Image.Image,
+                    stem: str) -> Dict[str, Dict[str, str]]:
+    renditions = {}
+    for rendition, size in Setup.RECIPE_IMAGE_RENDITIONS:
+        fitted = ImageOps.fit(image, size, Image.LANCZOS)
+        renditions[rendition] = {
+            extension: storage.save(
+                f'{Setup.RECIPE_IMAGE_RENDITIONS_FOLDER}/'
+                f'{stem}_{rendition}.{extension}',
+                encode(fitted, image_format))
+            for extension, image_format in RENDITION_FORMATS
+        }
+    return renditions
+
+
+def iter_rendition_names(renditions: dict):
+    for rendition, names in renditions.items():
+        if rendition != 'source':
+            yield from names.values()
+
+
+def is_image_processed(recipe: Recipe) -> bool:
+    """Return True if the recipe has no image or renditions of it."""
+    name = recipe.image.name
+    return not name or recipe.image_renditions.get('source') == name
+
+
+def process_recipe_image(recipe: Recipe) -> bool:
+    """Normalize the uploaded image of a recipe and save its renditions.
+
+    The image is re-encoded without metadata (EXIF orientation applied)
+    and scaled down to Setup.RECIPE_IMAGE_MAX_SIDE, then every rendition
+    of Setup.RECIPE_IMAGE_RENDITIONS is cropped to its size and saved in
+    every format of RENDITION_FORMATS. An upload which is already
+    normalized is kept as the source without re-encoding, so saving a
+    served source again neither loses quality nor makes new files.
+    Recipes whose renditions were made from the current image are
+    skipped, so calls may be repeated.
+
+    Returns True if the recipe was processed.
+    """
+    if is_image_processed(recipe):
+        return False
+
+    name = recipe.image.name
+
+    storage = recipe.image.storage
+    try:
+        with storage.open(name, 'rb') as file:
+            original = open_image(file)
+        image = normalize_mode(original)
+    except (OSError, Image.DecompressionBombError, ValueError):
+        return False
+
+    image_format = 'PNG' if image.mode == 'RGBA' else 'JPEG'
+    stem = os.path.splitext(os.path.basename(name))[0]
+    source_name = (
+        f'{Setup.RECIPES_IMAGE_FOLDER}/{stem}.{image_format.lower()}')
+    if is_normalized(original, image, image_format):
+        # stored byte for byte under the name of a source, so the same
+        # file saved again is the source it was served from
+        with storage.open(name, 'rb') as file:
+            source = storage.save(source_name, file)
+    else:
+        image.thumbnail((Setup.RECIPE_IMAGE_MAX_SIDE,) * 2, Image.LANCZOS)
+        encoded = encode(image, image_format)
+        # renditions are made from the pixels of the stored source, as
+        # when the source is uploaded again
+        image = normalize_mode(open_image(encoded))
+        source = storage.save(source_name, encoded)
+    renditions = save_renditions(
+        storage, image, os.path.splitext(os.path.basename(source))[0])
+    renditions['source'] = source
+
+    updated = Recipe.objects.filter(pk=recipe.pk, image=name).update(
+        image=source, image_renditions=renditions)
+    if not updated:
+        # the image was replaced meanwhile
+        release_image('', renditions)
+        return False
+
+    recipe.image.name = source
+    recipe.image_renditions = renditions
+    recipe.remember_image()
+    # the update sends no signals, bump the versions of the cached
+    # responses that show the uploaded image
+    bump_recipe_version(recipe.pk)
+    bump_catalog_version()
+    if source != name:
+        transaction.on_commit(partial(release_image, name))
+    return True
+
+
+def is_image_referenced(name: str) -> bool:
+    return Recipe.objects.filter(image=name).exists()
+
+
+def is_recently_saved(storage, name: str, grace: Optional[int] = None):
+    """Return True if the file was saved or touched within ``grace``
+    seconds, settings.RECIPE_IMAGE_GRACE_PERIOD by default, or is gone."""
+    if grace is None:
+        grace = settings.RECIPE_IMAGE_GRACE_PERIOD
+    threshold = timezone.now() - timedelta(seconds=grace)
+    try:
+        return storage.get_modified_time(name) > threshold
+    except FileNotFoundError:
+        return True
+
+
+def release_image(name: str, renditions: Optional[dict] = None):
+    """Delete image files no recipe refers to anymore.
+
+    Files are shared by recipes with identical images, so the image and
+    the source of the renditions are deleted only if no recipe uses them,
+    renditions go together with their source. Files saved within the
+    grace period are kept, an upload of the same content which is not
+    committed yet may refer to them, cleanup_recipe_images deletes them.
+    """
+    storage = Recipe._meta.get_field('image').storage
+    renditions = renditions or {}
+    source = renditions.get('source')
+    if (name and name != source and not is_recently_saved(storage, name)
+            and not is_image_referenced(name)):
+        storage.delete(name)
+    if (source and not is_recently_saved(storage, source)
+            and not is_image_referenced(source)):
+        for file_name in (source, *iter_rendition_names(renditions)):
+            storage.delete(file_name)
+
+
+def get_rendition_urls(renditions: dict, storage) -> Dict[str, dict]:
+    """Return {rendition: {extension: url}} of the rendition names stored
+    in Recipe.image_renditions."""
+    return {
+        rendition: {
+            extension: storage.url(file_name)
+            for extension, file_name in names.items()
+        }
+        for rendition, names in renditions.items()
+        if rendition != 'source'
+    }
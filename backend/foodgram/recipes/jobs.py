@@ -0,0 +1,122 @@
+import traceback
+from datetime import timedelta
+from typing import Callable, Dict, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .images import process_recipe_image
+from .models import Recipe, RecipeJob
+
+Status = RecipeJob.Status
+Task = RecipeJob.Task
+
+# Tasks must be idempotent, a job runs again after a failed attempt or
+# when its worker was stopped in the middle of it.
+TASKS: Dict[str, Callable[[Recipe], object]] = {
+    Task.PROCESS_IMAGE: process_recipe_image,
+}
+
+
+def enqueue_recipe_job(recipe: Recipe, task: str) -> Optional[RecipeJob]:
+    """Queue a task on the recipe for the run_recipe_jobs worker.
+
+    The job is inserted in the current transaction, so it is committed
+    together with the recipe, and a pending job of the same task is
+    reused. Without settings.RECIPE_JOBS_ASYNC the task runs right away
+    and None is returned.
+    """
+    if not settings.RECIPE_JOBS_ASYNC:
+        TASKS[task](recipe)
+        return None
+
+    job = RecipeJob.objects.filter(
+        recipe=recipe, task=task, status=Status.PENDING).first()
+    if job is None:
+        job = RecipeJob.objects.create(recipe=recipe, task=task)
+    return job
+
+
+def claim_recipe_job() -> Optional[RecipeJob]:
+    now = timezone.now()
+    with transaction.atomic():
+        job = (
+            RecipeJob.objects.select_for_update(skip_locked=True)
+            .filter(status=Status.PENDING, run_after__lte=now)
+            .order_by('run_after')
+            .first()
+        )
+        if job is not None:
+            job.status = Status.RUNNING
+            job.attempts += 1
+            job.started = now
+            job.save(update_fields=('status', 'attempts', 'started'))
+    return job
+
+
+def get_retry_delay(attempts: int) -> timedelta:
+    """Return the delay before the next attempt, doubled every time."""
+    return timedelta(
+        seconds=settings.RECIPE_JOB_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def run_recipe_job() -> Optional[RecipeJob]:
+    """Run the pending job which is due first.
+
+    A failed job is retried after get_retry_delay() until it has been
+    attempted settings.RECIPE_JOB_MAX_ATTEMPTS times. Returns the
+    processed job or None if no job is due.
+    """
+    job = claim_recipe_job()
+    if job is None:
+        return None
+
+    try:
+        recipe = Recipe.objects.get(pk=job.recipe_id)
+        with transaction.atomic():
+            TASKS[job.task](recipe)
+    except Recipe.DoesNotExist:
+        # deleted meanwhile together with the job
+        job.status = Status.DONE
+    except Exception:
+        job.error = traceback.format_exc()
+        if job.attempts < settings.RECIPE_JOB_MAX_ATTEMPTS:
+            job.status = Status.PENDING
+            job.run_after = timezone.now() + get_retry_delay(job.attempts)
+        else:
+            job.status = Status.FAILED
+    else:
+        job.status = Status.DONE
+        job.error = ''
+
+    if job.status != Status.PENDING:
+        job.finished = timezone.now()
+    # the job is gone if the recipe was deleted, so no save()
+    RecipeJob.objects.filter(pk=job.pk).update(
+        status=job.status, run_after=job.run_after, error=job.error,
+        finished=job.finished)
+    return job
+
+
+def requeue_stale_recipe_jobs() -> int:
+    """Return jobs running longer than settings.RECIPE_JOB_TIMEOUT, whose
+    worker was stopped, to the queue or fail them after the last attempt.
+    """
+    now = timezone.now()
+    stale = RecipeJob.objects.filter(
+        status=Status.RUNNING,
+        started__lt=now - timedelta(seconds=settings.RECIPE_JOB_TIMEOUT))
+    failed = stale.filter(
+        attempts__gte=settings.RECIPE_JOB_MAX_ATTEMPTS).update(
+            status=Status.FAILED, finished=now,
+            error='The worker was stopped')
+    requeued = stale.update(status=Status.PENDING, run_after=now)
+    return failed + requeued
+
+
+def delete_finished_recipe_jobs() -> int:
+    expired = timezone.now() - timedelta(seconds=settings.RECIPE_JOB_TTL)
+    deleted, _ = RecipeJob.objects.filter(
+        status=Status.DONE, finished__lt=expired).delete()
+    return deleted
@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recipes import Setup
+from recipes.images import is_recently_saved, iter_rendition_names
+from recipes.models import Recipe
+
+
+def iter_files(storage, path):
+    directories, files = storage.listdir(path)
+    for file_name in files:
+        yield f'{path}/{file_name}'
+    for directory in directories:
+        yield from iter_files(storage, f'{path}/{directory}')
+
+
+class Command(BaseCommand):
+    help = ('Delete files of the recipe images folder which no recipe '
+            'refers to, files changed within the grace period are kept '
+            'as they may belong to uploads in progress')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace', type=int,
+                            default=settings.RECIPE_IMAGE_GRACE_PERIOD,
+                            help='Grace period in seconds')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only list the orphaned files')
+
+    def handle(self, *args, **options):
+        storage = Recipe._meta.get_field('image').storage
+        if not storage.exists(Setup.RECIPES_IMAGE_FOLDER):
+            return
+        # listed before loading the references, so files saved meanwhile
+        # are not taken for orphans
+        names = list(iter_files(storage, Setup.RECIPES_IMAGE_FOLDER))
+
+        referenced = set()
+        images = Recipe.objects.values_list('image', 'image_renditions')
+        for image, renditions in images.iterator():
+            referenced.add(image)
+            referenced.add(renditions.get('source'))
+            referenced.update(iter_rendition_names(renditions))
+
+        deleted = 0
+        for name in names:
+            if (name in referenced
+                    or is_recently_saved(storage, name, options['grace'])):
+                continue
+            if options['dry_run']:
+                self.stdout.write(name)
+            else:
+                storage.delete(name)
+            deleted += 1
+        action = 'Found' if options['dry_run'] else 'Deleted'
+        self.stdout.write(f'{action} {deleted} orphaned files')
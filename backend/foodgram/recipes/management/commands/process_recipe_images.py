@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import process_recipe_image
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Normalize recipe images and save their renditions, recipes '
+            'processed since their image was uploaded are skipped')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='').only(
+            'id', 'image', 'image_renditions').order_by('pk')
+        processed = 0
+        for recipe in recipes.iterator():
+            processed += process_recipe_image(recipe)
+        self.stdout.write(f'Processed images of {processed} recipes')
@@ -0,0 +1,27 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from recipes.counters import repair_recipe_counters, repair_user_counters
+from recipes.models import Recipe
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = ('Recompute the favorites count of recipes and the recipes and '
+            'subscribers counts of users from their rows, in batches')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def repair(self, model, repair_counters, batch_size):
+        pks = list(model.objects.order_by('pk').values_list('pk', flat=True))
+        for start in range(0, len(pks), batch_size):
+            # every batch is a separate short UPDATE
+            repair_counters(pks[start:start + batch_size])
+        self.stdout.write(
+            f'Repaired counters of {len(pks)} {model._meta.verbose_name}s')
+
+    def handle(self, *args, **options):
+        self.repair(Recipe, repair_recipe_counters, options['batch_size'])
+        self.repair(User, repair_user_counters, options['batch_size'])
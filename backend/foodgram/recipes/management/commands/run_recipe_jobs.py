@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.jobs import (delete_finished_recipe_jobs,
+                          requeue_stale_recipe_jobs, run_recipe_job)
+
+
+class Command(BaseCommand):
+    help = ('Run deferred recipe work such as image processing, queued '
+            'when RECIPE_JOBS_ASYNC is on. Several workers may run at once')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='seconds to wait when there are no jobs')
+        parser.add_argument('--once', action='store_true',
+                            help='exit when there are no due jobs')
+
+    def handle(self, *args, **options):
+        while True:
+            requeue_stale_recipe_jobs()
+            delete_finished_recipe_jobs()
+            while True:
+                job = run_recipe_job()
+                if job is None:
+                    break
+                self.stdout.write(f'{job.pk} {job.task}: {job.status}')
+            if options['once']:
+                return
+            time.sleep(options['interval'])
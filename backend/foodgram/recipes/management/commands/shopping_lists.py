@@ -0,0 +1,73 @@
+from math import isclose
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from recipes.models import ShoppingListItem
+from recipes.shopping_lists import aggregate_totals, refresh_totals
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the stored shopping list totals of all users from '
+            'their shopping carts, or verify them with --verify')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help='compare the stored totals with the live '
+                                 'aggregation without changing them')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def get_user_id_batches(self, batch_size):
+        user_ids = User.objects.filter(
+            Q(shopping_carts__isnull=False)
+            | Q(shopping_list_items__isnull=False)
+        ).distinct().order_by('pk').values_list('pk', flat=True)
+        batch = []
+        for user_id in user_ids.iterator():
+            batch.append(user_id)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def get_mismatches(self, user_ids):
+        expected = {
+            (user_id, ingredient_id): total
+            for user_id, ingredient_id, total in aggregate_totals(user_ids)
+        }
+        stored = {
+            (user_id, ingredient_id): total
+            for user_id, ingredient_id, total
+            in ShoppingListItem.objects.filter(
+                user_id__in=user_ids).values_list(
+                    'user_id', 'ingredient_id', 'total')
+        }
+        return {
+            user_id for user_id, ingredient_id in expected.keys() | stored
+            if not isclose(expected.get((user_id, ingredient_id), 0),
+                           stored.get((user_id, ingredient_id), 0))
+        }
+
+    def handle(self, *args, **options):
+        batches = self.get_user_id_batches(options['batch_size'])
+        users = 0
+        mismatches = set()
+        for user_ids in batches:
+            users += len(user_ids)
+            if options['verify']:
+                mismatches |= self.get_mismatches(user_ids)
+            else:
+                refresh_totals(user_ids)
+
+        if not options['verify']:
+            self.stdout.write(f'Rebuilt shopping lists of {users} users')
+        elif mismatches:
+            raise CommandError(
+                f'Shopping lists of {len(mismatches)} of {users} users do '
+                f'not match their carts: {sorted(mismatches)[:20]}')
+        else:
+            self.stdout.write(f'Shopping lists of {users} users are valid')
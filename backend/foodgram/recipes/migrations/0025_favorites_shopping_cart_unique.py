@@ -0,0 +1,60 @@
+# Generated by Django 3.2.18 on 2026-10-18 18:14
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def delete_duplicates(model):
+    """Keep the first row of every (user, recipe) pair and return the
+    ids of users who had duplicates."""
+    duplicates = model.objects.values('user', 'recipe').annotate(
+        first=Min('id'), rows=Count('id')).filter(rows__gt=1).order_by()
+    user_ids = set()
+    for duplicate in duplicates:
+        model.objects.filter(
+            user=duplicate['user'], recipe=duplicate['recipe']
+        ).exclude(id=duplicate['first']).delete()
+        user_ids.add(duplicate['user'])
+    return user_ids
+
+
+def delete_duplicate_rows(apps, schema_editor):
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    delete_duplicates(apps.get_model('recipes', 'Favorites'))
+    user_ids = delete_duplicates(apps.get_model('recipes', 'ShoppingCart'))
+    if not user_ids:
+        return
+
+    # duplicated cart rows were counted twice in the shopping list totals
+    ShoppingListItem.objects.filter(user_id__in=user_ids).delete()
+    totals = RecipeIngredient.objects.filter(
+        recipe__shopping_carts__user__in=user_ids
+    ).values_list(
+        'recipe__shopping_carts__user', 'ingredient'
+    ).annotate(total=Sum('amount')).order_by()
+    ShoppingListItem.objects.bulk_create(
+        ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                         total=total)
+        for user_id, ingredient_id, total in totals
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0024_shopping_list_job'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            delete_duplicate_rows, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='favorites',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_favorite'),
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcart',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_shopping_cart'),
+        ),
+    ]
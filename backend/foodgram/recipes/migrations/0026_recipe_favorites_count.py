@@ -0,0 +1,31 @@
+# Generated by Django 3.2.18 on 2026-10-18 18:15
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_favorites_count(apps, schema_editor):
+    Favorites = apps.get_model('recipes', 'Favorites')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Recipe.objects.update(favorites_count=Coalesce(Subquery(
+        Favorites.objects.filter(recipe=OuterRef('pk')).order_by().values(
+            'recipe').annotate(count=Count('pk')).values('count')
+    ), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0025_favorites_shopping_cart_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Number of adds to favorites'),
+        ),
+        migrations.RunPython(
+            fill_favorites_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.18 on 2026-10-18 18:25
+
+from django.db import migrations, models
+import recipes.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0027_recipe_image_renditions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(db_index=True, storage=recipes.storage.get_recipe_image_storage, upload_to='recipes', verbose_name='Food photo'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.18 on 2026-10-18 18:47
+
+from django.db import migrations, models
+
+
+def start_running_jobs(apps, schema_editor):
+    # jobs running before the upgrade become stale after the timeout
+    ShoppingListJob = apps.get_model('recipes', 'ShoppingListJob')
+    ShoppingListJob.objects.filter(status='running').update(
+        started=models.F('created'), attempts=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0029_recipe_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shoppinglistjob',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='shoppinglistjob',
+            name='started',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(
+            start_running_jobs, migrations.RunPython.noop),
+    ]
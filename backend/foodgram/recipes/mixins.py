@@ -0,0 +1,18 @@
+class CounterFieldsMixin:
+    """Keep counter columns out of full saves of existing rows.
+
+    Counters listed in ``counter_fields`` are changed by F() updates only,
+    a full save must not overwrite them with the values loaded with the
+    instance.
+    """
+
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
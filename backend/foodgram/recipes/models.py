@@ -1,12 +1,21 @@
+from uuid import uuid4
+
 from django.contrib.auth import get_user_model
 from django.core.validators import (MinLengthValidator, MinValueValidator,
                                     RegexValidator)
-from django.db.models import (CASCADE, CharField, DateTimeField, FloatField,
-                              ForeignKey, ImageField, IntegerField,
-                              ManyToManyField, Model, TextField, SlugField)
+from django.db.models import (CASCADE, BinaryField, CharField, DateTimeField,
+                              Exists, F, FloatField, ForeignKey, ImageField,
+                              IntegerField, JSONField, ManyToManyField, Model,
+                              OuterRef, PositiveIntegerField, QuerySet, Index,
+                              TextField, SlugField, TextChoices,
+                              UniqueConstraint, UUIDField, Window)
+from django.db.models.functions import RowNumber
+from django.utils import timezone
 
 from recipes import Setup
 
+from .mixins import CounterFieldsMixin
+from .storage import get_recipe_image_storage
 from .validators import BorderedMinValueValidator
 
 
@@ -42,7 +51,47 @@ class Ingredient(Model):
         return f'{self.name}, {self.measurement_unit}'
 
 
-class Recipe(Model):
+class RecipeQuerySet(QuerySet):
+    def with_user_flags(self, user):
+        """Annotate recipes with is_favorited and is_in_shopping_cart
+        flags of the given user, so they are resolved in the main query.
+        """
+        if user.is_anonymous:
+            return self
+        return self.annotate(
+            is_favorited=Exists(Favorites.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+        )
+
+    def latest_for_authors(self, author_ids, limit=None):
+        """Return recipes of the given authors in one query, at most
+        ``limit`` latest recipes per author if the limit is given.
+
+        The limit is applied with ROW_NUMBER() partitioned by author.
+        """
+        recipes = self.filter(author_id__in=author_ids)
+        if limit is None:
+            return list(recipes)
+
+        ranked_recipes = recipes.annotate(
+            preview_number=Window(
+                expression=RowNumber(),
+                partition_by=F('author_id'),
+                order_by=(F('pub_date').desc(), F('pk').asc()),
+            )
+        )
+        sql, params = ranked_recipes.query.sql_with_params()
+        return list(self.model.objects.db_manager(self.db).raw(
+            f'SELECT * FROM ({sql}) ranked_recipes '
+            f'WHERE preview_number <= %s '
+            f'ORDER BY author_id, preview_number',
+            (*params, limit),
+        ))
+
+
+class Recipe(CounterFieldsMixin, Model):
 
     author = ForeignKey(User,
                         on_delete=CASCADE,
@@ -54,8 +103,16 @@ class Recipe(Model):
                          MinLengthValidator(Setup.MIN_RECIPE_NAME_LENGTH),))
 
     image = ImageField(upload_to=Setup.RECIPES_IMAGE_FOLDER,
+                       storage=get_recipe_image_storage,
+                       db_index=True,
                        verbose_name='Food photo')
 
+    image_renditions = JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Food photo renditions')
+
     text = TextField()
 
     cooking_time = IntegerField(verbose_name='Cooking time, minutes',
@@ -71,15 +128,60 @@ class Recipe(Model):
                              auto_now_add=True,
                              editable=False,)
 
+    favorites_count = PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Number of adds to favorites')
+
+    objects = RecipeQuerySet.as_manager()
+
+    counter_fields = ('favorites_count',)
+
     def __str__(self) -> str:
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_image()
+        return instance
+
+    def remember_image(self):
+        """Remember the stored image and renditions, so the files can be
+        released once a save replaces them."""
+        if {'image', 'image_renditions'} & self.get_deferred_fields():
+            self._stored_image = None
+        else:
+            self._stored_image = (self.image.name, self.image_renditions)
+
+    def get_replaced_image(self):
+        """Return the remembered (name, renditions) if the image was
+        changed since, otherwise None."""
+        stored = getattr(self, '_stored_image', None)
+        if stored is None or stored[0] == self.image.name:
+            return None
+        return stored
+
+    def save(self, *args, **kwargs):
+        # the renditions belong to the replaced image, which is released
+        # after the save, and are made again from the new one
+        if self.get_replaced_image() is not None:
+            self.image_renditions = {}
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'image' in update_fields:
+                kwargs['update_fields'] = {*update_fields, 'image_renditions'}
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = 'Recipe'
 
         verbose_name_plural = 'Recipes'
 
-        ordering = ('-pub_date', )
+        ordering = ('-pub_date', 'id')
+
+        indexes = (
+            Index(fields=('-pub_date', 'id'), name='recipe_pub_date_id_idx'),
+        )
 
 
 class RecipeIngredient(Model):
@@ -128,6 +230,10 @@ class Favorites(Model):
     class Meta:
         ordering = ['user_id']
         verbose_name_plural = 'Favorites'
+        constraints = (
+            UniqueConstraint(fields=('user', 'recipe'),
+                             name='unique_favorite'),
+        )
 
 
 class ShoppingCart(Model):
@@ -147,3 +253,133 @@ class ShoppingCart(Model):
         verbose_name = 'Shopping list'
 
         verbose_name_plural = 'Shopping lists'
+
+        constraints = (
+            UniqueConstraint(fields=('user', 'recipe'),
+                             name='unique_shopping_cart'),
+        )
+
+
+class ShoppingListItem(Model):
+    """Total amount of an ingredient over all recipes in a user's shopping
+    cart, kept up to date by recipes.shopping_lists."""
+
+    user = ForeignKey(User,
+                      on_delete=CASCADE,
+                      verbose_name='User',
+                      related_name='shopping_list_items')
+
+    ingredient = ForeignKey(Ingredient,
+                            on_delete=CASCADE,
+                            verbose_name='Ingredient',
+                            related_name='shopping_list_items')
+
+    total = FloatField(verbose_name='Total amount')
+
+    def __str__(self) -> str:
+        return f'{self.user_id}_{self.ingredient_id}'
+
+    class Meta:
+        unique_together = ['user', 'ingredient']
+
+        verbose_name = 'Shopping list item'
+
+
+class ShoppingListJob(Model):
+    """Shopping list document rendered by the render_shopping_lists
+    worker instead of the request thread."""
+
+    class Status(TextChoices):
+        PENDING = 'pending'
+        RUNNING = 'running'
+        DONE = 'done'
+        FAILED = 'failed'
+
+    id = UUIDField(primary_key=True, default=uuid4, editable=False)
+
+    user = ForeignKey(User,
+                      on_delete=CASCADE,
+                      verbose_name='User',
+                      related_name='shopping_list_jobs')
+
+    status = CharField(max_length=10,
+                       choices=Status.choices,
+                       default=Status.PENDING)
+
+    content_hash = CharField(max_length=40,
+                             verbose_name='Shopping cart hash')
+
+    document = BinaryField(null=True, editable=False)
+
+    error = TextField(blank=True)
+
+    attempts = PositiveIntegerField(default=0)
+
+    created = DateTimeField(auto_now_add=True)
+
+    started = DateTimeField(null=True, blank=True)
+
+    finished = DateTimeField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        return f'{self.user_id}_{self.status}_{self.pk}'
+
+    class Meta:
+        ordering = ('created',)
+
+        verbose_name = 'Shopping list job'
+
+        indexes = (
+            Index(fields=('status', 'created'),
+                  name='shopping_list_job_status_idx'),
+        )
+
+
+class RecipeJob(Model):
+    """Deferred work on a recipe done by the run_recipe_jobs worker after
+    the request which saved the recipe has committed."""
+
+    class Task(TextChoices):
+        PROCESS_IMAGE = 'process_image'
+
+    class Status(TextChoices):
+        PENDING = 'pending'
+        RUNNING = 'running'
+        DONE = 'done'
+        FAILED = 'failed'
+
+    recipe = ForeignKey(Recipe,
+                        on_delete=CASCADE,
+                        verbose_name='Recipe',
+                        related_name='jobs')
+
+    task = CharField(max_length=30, choices=Task.choices)
+
+    status = CharField(max_length=10,
+                       choices=Status.choices,
+                       default=Status.PENDING)
+
+    attempts = PositiveIntegerField(default=0)
+
+    run_after = DateTimeField(default=timezone.now)
+
+    started = DateTimeField(null=True, blank=True)
+
+    finished = DateTimeField(null=True, blank=True)
+
+    error = TextField(blank=True)
+
+    created = DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f'{self.recipe_id}_{self.task}_{self.status}'
+
+    class Meta:
+        ordering = ('run_after',)
+
+        verbose_name = 'Recipe job'
+
+        indexes = (
+            Index(fields=('status', 'run_after'),
+                  name='recipe_job_status_idx'),
+        )
@@ -0,0 +1,23 @@
+from django.db import connections
+from django.db.models import QuerySet
+
+
+def delete_rows(queryset: QuerySet) -> int:
+    """Delete the rows of ``queryset`` with a single raw DELETE statement
+    and return their number.
+
+    Unlike ``QuerySet.delete()`` the rows are not fetched first, so no
+    signals are sent and no cascades or ``on_delete`` handlers run. Use it
+    only for rows nothing references, the caller does the work of their
+    receivers.
+    """
+    model = queryset.model
+    connection = connections[queryset.db]
+    quote_name = connection.ops.quote_name
+    sql, params = queryset.values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {quote_name(model._meta.db_table)} '
+            f'WHERE {quote_name(model._meta.pk.column)} IN ({sql})',
+            params)
+        return cursor.rowcount
@@ -0,0 +1,166 @@
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from django.db import DatabaseError
+
+from recipes import Setup
+
+from .models import Ingredient, Recipe, Tag
+from .versions import get_ingredient_version, get_tag_version
+
+
+class ProcessRegistry:
+    """Base class of in-memory snapshots kept once per worker process.
+
+    A snapshot is built on first use (or by warm() at startup) together
+    with the shared version returned by ``get_version``. The signal
+    receivers bump that version in the cache once their transaction
+    commits, so every worker process reloads on its next use. Snapshots
+    also expire after ``ttl`` seconds, for changes made without signals.
+    """
+
+    def __init__(self, ttl: float, get_version: Callable[[], int]):
+        self.ttl = ttl
+        self.get_version = get_version
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._snapshot = None
+
+    def build_snapshot(self) -> dict:
+        raise NotImplementedError
+
+    def _load(self):
+        generation = self._generation
+        # read before the rows, a bump while they load causes a reload
+        version = self.get_version()
+        snapshot = self.build_snapshot()
+        snapshot['version'] = version
+        snapshot['expires'] = time.monotonic() + self.ttl
+        with self._lock:
+            if generation == self._generation:
+                self._snapshot = snapshot
+        return snapshot
+
+    def _get_snapshot(self):
+        snapshot = self._snapshot
+        if (snapshot is None
+                or snapshot['expires'] < time.monotonic()
+                or snapshot['version'] != self.get_version()):
+            snapshot = self._load()
+        return snapshot
+
+    def warm(self):
+        try:
+            self._load()
+        except DatabaseError:
+            pass
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._snapshot = None
+
+
+class TagRegistry(ProcessRegistry):
+    """In-memory copy of all tags."""
+
+    def __init__(self, ttl: float = Setup.TAG_REGISTRY_TTL):
+        super().__init__(ttl, get_tag_version)
+
+    def build_snapshot(self):
+        tags = list(Tag.objects.order_by('pk'))
+        return {
+            'tags': tags,
+            'by_pk': {tag.pk: tag for tag in tags},
+            'slugs': tuple((tag.slug, tag.name) for tag in tags),
+        }
+
+    def all(self) -> List[Tag]:
+        return list(self._get_snapshot()['tags'])
+
+    def get(self, pk) -> Tag:
+        """Return tag by its primary key.
+
+        Raises
+        ------
+        Tag.DoesNotExist
+            if there is no tag with the given primary key
+        """
+        try:
+            return self._get_snapshot()['by_pk'][int(pk)]
+        except (KeyError, TypeError, ValueError):
+            raise Tag.DoesNotExist(f'Tag with pk={pk} does not exist')
+
+    def get_many(self, pks: Iterable[int]) -> List[Tag]:
+        by_pk = self._get_snapshot()['by_pk']
+        return [by_pk[pk] for pk in sorted(pks) if pk in by_pk]
+
+    def slug_choices(self) -> Tuple[Tuple[str, str], ...]:
+        return self._get_snapshot()['slugs']
+
+
+tag_registry = TagRegistry()
+
+
+class IngredientIndex(ProcessRegistry):
+    """Case-folded sorted index of ingredient names for autocomplete.
+
+    Prefix matches are found with bisect over the sorted names, names
+    containing the query elsewhere follow them as a second tier. Both
+    tiers keep the primary key order of the ingredients list.
+    """
+
+    def __init__(self, ttl: float = Setup.INGREDIENT_INDEX_TTL):
+        super().__init__(ttl, get_ingredient_version)
+
+    def build_snapshot(self):
+        ingredients = Ingredient.objects.order_by('pk').values(
+            'id', 'name', 'measurement_unit')
+        by_pk = {}
+        names = []
+        for ingredient in ingredients:
+            by_pk[ingredient['id']] = ingredient
+            names.append((ingredient['name'].casefold(), ingredient['id']))
+        return {
+            'by_pk': by_pk,
+            'names': names,
+            'sorted_names': sorted(names),
+        }
+
+    def all(self) -> List[dict]:
+        return list(self._get_snapshot()['by_pk'].values())
+
+    def search(self, query: str) -> List[dict]:
+        snapshot = self._get_snapshot()
+        query = query.casefold()
+        sorted_names = snapshot['sorted_names']
+
+        start = bisect_left(sorted_names, (query,))
+        end = bisect_left(sorted_names, (query + '\U0010ffff',), start)
+        prefix_pks = sorted(pk for _, pk in sorted_names[start:end])
+        contains_pks = [
+            pk for name, pk in snapshot['names']
+            if query in name and not name.startswith(query)
+        ]
+
+        by_pk = snapshot['by_pk']
+        return [by_pk[pk] for pk in prefix_pks + contains_pks]
+
+
+ingredient_index = IngredientIndex()
+
+
+def get_recipes_tag_ids(recipe_ids: Iterable[int]) -> Dict[int, List[int]]:
+    """Load tag ids of the given recipes from the m2m table in one query,
+    without joining the tag table."""
+    recipe_tag_ids = {recipe_id: [] for recipe_id in recipe_ids}
+    if not recipe_tag_ids:
+        return recipe_tag_ids
+
+    rows = Recipe.tag.through.objects.filter(
+        recipe_id__in=recipe_tag_ids).values_list('recipe_id', 'tag_id')
+    for recipe_id, tag_id in rows:
+        recipe_tag_ids[recipe_id].append(tag_id)
+    return recipe_tag_ids
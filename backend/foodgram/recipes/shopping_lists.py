@@ -0,0 +1,92 @@
+from typing import Iterable, Optional
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Sum
+
+from .models import RecipeIngredient, ShoppingCart, ShoppingListItem
+
+User = get_user_model()
+
+
+def aggregate_totals(user_ids: Iterable[int],
+                     ingredient_ids: Optional[Iterable[int]] = None):
+    """Sum ingredient amounts of the recipes in the users' shopping carts.
+
+    Returns (user_id, ingredient_id, total) tuples.
+    """
+    rows = RecipeIngredient.objects.filter(
+        recipe__shopping_carts__user__in=user_ids)
+    if ingredient_ids is not None:
+        rows = rows.filter(ingredient_id__in=ingredient_ids)
+    return rows.values_list(
+        'recipe__shopping_carts__user', 'ingredient'
+    ).annotate(total=Sum('amount')).order_by()
+
+
+def refresh_totals(user_ids: Iterable[int],
+                   ingredient_ids: Optional[Iterable[int]] = None):
+    """Recompute the stored totals of the given users.
+
+    Only the given ingredients are recomputed if ``ingredient_ids`` is
+    passed, so adding a recipe to a cart touches the rows of its own
+    ingredients only. The user rows are locked while their totals are
+    replaced, concurrent refreshes of a user wait for each other.
+    """
+    user_ids = list(user_ids)
+    if ingredient_ids is not None:
+        ingredient_ids = list(ingredient_ids)
+    if not user_ids or ingredient_ids == []:
+        return
+
+    items = ShoppingListItem.objects.filter(user_id__in=user_ids)
+    if ingredient_ids is not None:
+        items = items.filter(ingredient_id__in=ingredient_ids)
+    with transaction.atomic():
+        # rows of a user are replaced by one transaction at a time, the
+        # unique (user, ingredient) rows of concurrent ones would collide
+        list(User.objects.select_for_update().filter(
+            pk__in=user_ids).order_by('pk').values_list('pk', flat=True))
+        items.delete()
+        ShoppingListItem.objects.bulk_create(
+            ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                             total=total)
+            for user_id, ingredient_id, total
+            in aggregate_totals(user_ids, ingredient_ids)
+        )
+
+
+def get_recipe_ingredient_ids(recipe_id: int):
+    return list(RecipeIngredient.objects.filter(
+        recipe_id=recipe_id).values_list('ingredient_id', flat=True))
+
+
+def refresh_cart_recipe(user_id: int, recipe_id: int):
+    """Update the totals of a user who added or removed a recipe."""
+    ingredient_ids = get_recipe_ingredient_ids(recipe_id)
+    # the ingredients of a recipe are gone when it is being deleted
+    refresh_totals([user_id], ingredient_ids or None)
+
+
+def refresh_recipe(recipe_id: int, ingredient_ids: Iterable[int] = None):
+    """Update the totals of users having the recipe in their carts after
+    its ingredients changed.
+
+    Ingredients of the recipe are recomputed by default, ingredients which
+    were removed from it have to be passed explicitly.
+    """
+    user_ids = list(ShoppingCart.objects.filter(
+        recipe_id=recipe_id).values_list('user_id', flat=True))
+    if not user_ids:
+        return
+    if ingredient_ids is None:
+        ingredient_ids = get_recipe_ingredient_ids(recipe_id)
+    refresh_totals(user_ids, ingredient_ids)
+
+
+def get_shopping_list(user):
+    """Return the stored shopping list of a user in the shape of the
+    shopping list renderer."""
+    return ShoppingListItem.objects.filter(user=user).values(
+        'ingredient__name', 'ingredient__measurement_unit', 'total'
+    ).order_by('ingredient__name', 'ingredient__measurement_unit')
@@ -0,0 +1,151 @@
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_save)
+from django.dispatch import receiver
+
+from users.models import Subscribe
+
+from .counters import change_counter
+from .images import is_image_processed, release_image
+from .jobs import enqueue_recipe_job
+from .models import (Favorites, Ingredient, Recipe, RecipeIngredient,
+                     RecipeJob, ShoppingCart, Tag)
+from .registry import ingredient_index, tag_registry
+from .shopping_lists import refresh_cart_recipe, refresh_recipe
+from .versions import (bump_catalog_version, bump_counter_versions,
+                       bump_ingredient_version, bump_recipe_version,
+                       bump_tag_version, bump_user_version)
+
+User = get_user_model()
+
+
+# after the commit, a reload before it would keep the old rows
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_tag_registry(**kwargs):
+    bump_tag_version()
+    transaction.on_commit(tag_registry.invalidate)
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredient_index(**kwargs):
+    bump_ingredient_version()
+    transaction.on_commit(ingredient_index.invalidate)
+
+
+@receiver((post_save, post_delete), sender=Tag)
+@receiver((post_save, post_delete), sender=Ingredient)
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+@receiver(m2m_changed, sender=Recipe.tag.through)
+def invalidate_catalog(**kwargs):
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=Recipe)
+def invalidate_recipe(instance, **kwargs):
+    bump_recipe_version(instance.pk)
+
+
+# connected before process_image, which remembers the processed image
+@receiver(post_save, sender=Recipe)
+def release_replaced_image(instance, **kwargs):
+    replaced = instance.get_replaced_image()
+    if replaced is not None:
+        transaction.on_commit(partial(release_image, *replaced))
+    instance.remember_image()
+
+
+@receiver(post_save, sender=Recipe)
+def process_image(instance, **kwargs):
+    if not is_image_processed(instance):
+        enqueue_recipe_job(instance, RecipeJob.Task.PROCESS_IMAGE)
+
+
+@receiver(post_delete, sender=Recipe)
+def release_deleted_image(instance, **kwargs):
+    if 'image' in instance.get_deferred_fields():
+        return
+    renditions = {}
+    if 'image_renditions' not in instance.get_deferred_fields():
+        renditions = instance.image_renditions
+    transaction.on_commit(
+        partial(release_image, instance.image.name, renditions))
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def invalidate_recipe_ingredients(instance, **kwargs):
+    bump_recipe_version(instance.recipe_id)
+
+
+@receiver((post_save, post_delete), sender=User)
+def invalidate_catalog_authors(update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    bump_catalog_version()
+
+
+@receiver((post_save, post_delete), sender=Favorites)
+@receiver((post_save, post_delete), sender=ShoppingCart)
+@receiver((post_save, post_delete), sender=Subscribe)
+def invalidate_user_flags(instance, **kwargs):
+    bump_user_version(instance.user_id)
+
+
+@receiver((post_save, post_delete), sender=ShoppingCart)
+def update_shopping_list(instance, **kwargs):
+    refresh_cart_recipe(instance.user_id, instance.recipe_id)
+
+
+@receiver(pre_save, sender=RecipeIngredient)
+def remember_ingredient(instance, **kwargs):
+    instance._previous_ingredient_id = None
+    if instance.pk is not None:
+        instance._previous_ingredient_id = RecipeIngredient.objects.filter(
+            pk=instance.pk).values_list('ingredient_id', flat=True).first()
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def update_shopping_lists_ingredient(instance, **kwargs):
+    ingredient_ids = {instance.ingredient_id}
+    previous = getattr(instance, '_previous_ingredient_id', None)
+    if previous is not None:
+        ingredient_ids.add(previous)
+    refresh_recipe(instance.recipe_id, ingredient_ids)
+
+
+def get_counter_delta(signal, created=False):
+    """Return the counter change for a saved or deleted row, updates of
+    existing rows change nothing."""
+    if signal is post_delete:
+        return -1
+    return 1 if created else 0
+
+
+@receiver((post_save, post_delete), sender=Favorites)
+def update_favorites_count(instance, signal, created=False, **kwargs):
+    delta = get_counter_delta(signal, created)
+    if delta:
+        change_counter(Recipe.objects.filter(pk=instance.recipe_id),
+                       'favorites_count', delta)
+        bump_counter_versions(recipe_ids=[instance.recipe_id])
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def update_recipes_count(instance, signal, created=False, **kwargs):
+    delta = get_counter_delta(signal, created)
+    if delta:
+        change_counter(User.objects.filter(pk=instance.author_id),
+                       'recipes_count', delta)
+        bump_counter_versions(user_ids=[instance.author_id])
+
+
+@receiver((post_save, post_delete), sender=Subscribe)
+def update_subscribers_count(instance, signal, created=False, **kwargs):
+    delta = get_counter_delta(signal, created)
+    if delta:
+        change_counter(User.objects.filter(pk=instance.subscribe_id),
+                       'subscribers_count', delta)
+        bump_counter_versions(user_ids=[instance.subscribe_id])
@@ -0,0 +1,45 @@
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage naming files by the SHA-256 of their content.
+
+    A file is saved as ``<directory>/<xx>/<sha256><extension>`` where xx
+    are the first two digits of the hash, so identical uploads share one
+    file. Saving content which is already stored only touches the file,
+    release_image and the cleanup_recipe_images command keep recently
+    touched files.
+    """
+
+    def get_content_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        directory, file_name = os.path.split(name)
+        extension = os.path.splitext(file_name)[1].lower()
+        hexdigest = digest.hexdigest()
+        return '/'.join(
+            part for part in (directory, hexdigest[:2], hexdigest + extension)
+            if part
+        )
+
+    def _save(self, name, content):
+        name = self.get_content_name(name, content)
+        if self.exists(name):
+            try:
+                os.utime(self.path(name))
+                return name
+            except FileNotFoundError:
+                # deleted meanwhile, saved again below
+                pass
+        return super()._save(name, content)
+
+
+recipe_image_storage = ContentAddressedStorage()
+
+
+def get_recipe_image_storage():
+    return recipe_image_storage
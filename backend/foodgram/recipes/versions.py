@@ -0,0 +1,128 @@
+import time
+from functools import partial
+from typing import Dict, Iterable, List
+
+from django.core.cache import cache
+from django.db import transaction
+
+CATALOG_VERSION_KEY = 'recipes:catalog-version'
+USER_VERSION_KEY = 'recipes:user-version:{user_id}'
+RECIPE_VERSION_KEY = 'recipes:recipe-version:{recipe_id}'
+TAG_VERSION_KEY = 'recipes:tag-version'
+INGREDIENT_VERSION_KEY = 'recipes:ingredient-version'
+RECIPE_COUNTERS_VERSION_KEY = 'recipes:recipe-counters-version:{recipe_id}'
+USER_COUNTERS_VERSION_KEY = 'recipes:user-counters-version:{user_id}'
+
+
+def _get_version(key: str) -> int:
+    version = cache.get(key)
+    if version is None:
+        version = time.time_ns()
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key, version)
+    return version
+
+
+def _get_versions(keys: Iterable[str]) -> Dict[str, int]:
+    versions = cache.get_many(keys)
+    for key in set(keys) - versions.keys():
+        versions[key] = _get_version(key)
+    return versions
+
+
+def _bump_version(key: str):
+    # Versions are the bump time in nanoseconds, so a new version never
+    # repeats one evicted from the cache and doubles as a Last-Modified.
+    cache.set(key, time.time_ns(), timeout=None)
+
+
+def get_last_modified(version: int) -> int:
+    """Return the modification timestamp of the given version."""
+    return version // 10 ** 9
+
+
+def get_catalog_version() -> int:
+    """Return the current version of the public recipe catalog."""
+    return _get_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    """Bump the catalog version once the current transaction commits, so
+    responses cached under the old version are never served again."""
+    transaction.on_commit(partial(_bump_version, CATALOG_VERSION_KEY))
+
+
+def get_tag_version() -> int:
+    """Return the version of the tag list."""
+    return _get_version(TAG_VERSION_KEY)
+
+
+def bump_tag_version():
+    transaction.on_commit(partial(_bump_version, TAG_VERSION_KEY))
+
+
+def get_ingredient_version() -> int:
+    """Return the version of the ingredient list."""
+    return _get_version(INGREDIENT_VERSION_KEY)
+
+
+def bump_ingredient_version():
+    transaction.on_commit(partial(_bump_version, INGREDIENT_VERSION_KEY))
+
+
+def get_user_version(user_id: int) -> int:
+    """Return the version of the user's favorites, shopping cart and
+    subscriptions."""
+    return _get_version(USER_VERSION_KEY.format(user_id=user_id))
+
+
+def bump_user_version(user_id: int):
+    transaction.on_commit(
+        partial(_bump_version, USER_VERSION_KEY.format(user_id=user_id)))
+
+
+def get_recipe_versions(recipe_ids: Iterable[int]) -> Dict[int, int]:
+    """Return versions of the ingredients of the given recipes."""
+    keys = {
+        RECIPE_VERSION_KEY.format(recipe_id=recipe_id): recipe_id
+        for recipe_id in recipe_ids
+    }
+    versions = _get_versions(keys)
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def bump_recipe_version(recipe_id: int):
+    transaction.on_commit(partial(
+        _bump_version, RECIPE_VERSION_KEY.format(recipe_id=recipe_id)))
+
+
+def _get_counter_keys(recipe_ids: Iterable[int],
+                      user_ids: Iterable[int]) -> List[str]:
+    return [
+        *(RECIPE_COUNTERS_VERSION_KEY.format(recipe_id=recipe_id)
+          for recipe_id in recipe_ids),
+        *(USER_COUNTERS_VERSION_KEY.format(user_id=user_id)
+          for user_id in user_ids),
+    ]
+
+
+def get_counter_versions(recipe_ids: Iterable[int],
+                         user_ids: Iterable[int]) -> Dict[str, int]:
+    """Return versions of the counters of the given recipes and users.
+
+    Counters change on every favorite and subscription, so they are kept
+    out of the catalog version and only invalidate the responses showing
+    them.
+    """
+    return _get_versions(_get_counter_keys(recipe_ids, user_ids))
+
+
+def bump_counter_versions(recipe_ids: Iterable[int] = (),
+                          user_ids: Iterable[int] = ()):
+    keys = _get_counter_keys(recipe_ids, user_ids)
+
+    def bump():
+        version = time.time_ns()
+        cache.set_many(dict.fromkeys(keys, version), timeout=None)
+
+    transaction.on_commit(bump)
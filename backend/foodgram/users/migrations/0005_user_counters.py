@@ -0,0 +1,44 @@
+# Generated by Django 3.2.18 on 2026-10-18 18:15
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_rows(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+            field).annotate(count=Count('pk')).values('count')
+    ), 0)
+
+
+def fill_counters(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    User.objects.update(
+        recipes_count=count_rows(
+            apps.get_model('recipes', 'Recipe'), 'author'),
+        subscribers_count=count_rows(
+            apps.get_model('users', 'Subscribe'), 'subscribe'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_auto_20230503_2146'),
+        ('recipes', '0026_recipe_favorites_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Number of recipes'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='subscribers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Number of subscribers'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
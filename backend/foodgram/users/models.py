@@ -2,10 +2,11 @@ from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
 from django.db import models
 
+from recipes.mixins import CounterFieldsMixin
 from users import Setup
 
 
-class User(AbstractUser):
+class User(CounterFieldsMixin, AbstractUser):
     email = models.EmailField(
         unique=True,
         max_length=Setup.EMAIL_MAX_LENGTH,
@@ -20,9 +21,23 @@ class User(AbstractUser):
         unique=True,
     )
 
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Number of recipes'
+    )
+
+    subscribers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Number of subscribers'
+    )
+
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', ]
 
+    counter_fields = ('recipes_count', 'subscribers_count')
+
     class Meta:
         verbose_name = 'User'
         verbose_name_plural = 'Users'